@@ -0,0 +1,43 @@
+# Copyright © 2017 Tom Hacohen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import os
+import tempfile
+import uuid
+
+import django
+
+
+def setup(file_database=False):
+    """Configure Django with the test settings and create a test database.
+
+    SQLite test databases are in memory, which doesn't allow concurrent writers to wait for each other, so pass
+    file_database=True to use a temporary file instead.
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.test_settings')
+    from django.conf import settings
+    database = settings.DATABASES['default']
+    if file_database and database['ENGINE'] == 'django.db.backends.sqlite3':
+        database.setdefault('TEST', {})['NAME'] = os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite3')
+        database.setdefault('OPTIONS', {})['timeout'] = 30
+
+    django.setup()
+    from django.test.utils import setup_test_environment, setup_databases
+    setup_test_environment()
+    return setup_databases(verbosity=0, interactive=False)
+
+
+def random_hash():
+    return hashlib.sha256(uuid.uuid4().bytes).hexdigest()
@@ -0,0 +1,76 @@
+# Copyright © 2017 Tom Hacohen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Compare the old (OR over a join + DISTINCT) and the EXISTS journal access queries.
+
+Every user can access N journals, half owned and half shared with them, each with a CONTENT_SIZE content blob.
+Both queries are run the way the journal list runs them.
+
+Run from the repository root: python -m benchmarks.access_query [journals per user...]
+"""
+
+import sys
+import time
+
+from . import random_hash, setup
+
+CONTENT_SIZE = 4096
+REPEAT = 5
+
+
+def old_filter_accessible(queryset, user):
+    from django.db.models import Q
+    return queryset.filter(Q(owner=user) | Q(members__user=user), deleted=False).distinct()
+
+
+def best_time(func):
+    best = None
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(sizes):
+    setup()
+    from django.contrib.auth import get_user_model
+    from journal import access, models
+
+    User = get_user_model()
+    other = User.objects.create(username='other')
+
+    print('{:>8} {:>12} {:>12} {:>8}'.format('journals', 'distinct', 'exists', 'speedup'))
+    for size in sizes:
+        user = User.objects.create(username='user{}'.format(size))
+        owned = [models.Journal(owner=user, uid=random_hash(), content=b'x' * CONTENT_SIZE) for _ in range(size // 2)]
+        shared = [models.Journal(owner=other, uid=random_hash(), content=b'x' * CONTENT_SIZE)
+                  for _ in range(size - size // 2)]
+        models.Journal.objects.bulk_create(owned + shared)
+        shared = models.Journal.objects.filter(owner=other).order_by('-pk')[:len(shared)]
+        models.JournalMember.objects.bulk_create([models.JournalMember(journal=journal, user=user, key=b'key')
+                                                  for journal in shared])
+
+        old = old_filter_accessible(models.Journal.objects, user)
+        new = access.filter_accessible(models.Journal.objects, user)
+        assert sorted(old.values_list('pk', flat=True)) == sorted(new.values_list('pk', flat=True))
+
+        old_time = best_time(lambda: list(old.all()))
+        new_time = best_time(lambda: list(new.all()))
+        print('{:>8} {:>11.4f}s {:>11.4f}s {:>7.1f}x'.format(size, old_time, new_time, old_time / new_time))
+
+
+if __name__ == '__main__':
+    main([int(x) for x in sys.argv[1:]] or [10, 1000, 10000])
@@ -0,0 +1,89 @@
+# Copyright © 2017 Tom Hacohen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Many clients appending to the same journal at once.
+
+Every client fetches the journal's last uid, then appends an entry after it, starting over on a conflict (409).
+Reports appends/sec and the conflict rate.
+
+Run from the repository root: python -m benchmarks.append_contention [threads] [seconds]
+"""
+
+import sys
+import threading
+import time
+
+from . import random_hash, setup
+
+
+def worker(user, journal_uid, deadline, results):
+    from django.db import connection
+    from django.urls import reverse
+    from rest_framework.test import APIClient
+
+    client = APIClient()
+    client.force_authenticate(user=user)
+    detail_url = reverse('journal-detail', kwargs={'uid': journal_uid})
+    list_url = reverse('journal-entries-list', kwargs={'journal_uid': journal_uid})
+    counts = {'created': 0, 'conflict': 0, 'error': 0}
+
+    try:
+        while time.perf_counter() < deadline:
+            last = client.get(detail_url).data['lastUid']
+            query = '?last={}'.format(last) if last is not None else ''
+            response = client.post(list_url + query, {'uid': random_hash(), 'content': 'dGVzdA=='})
+            if response.status_code == 201:
+                counts['created'] += 1
+            elif response.status_code == 409:
+                counts['conflict'] += 1
+            else:
+                counts['error'] += 1
+    finally:
+        connection.close()
+
+    results.append(counts)
+
+
+def main(threads, seconds):
+    setup(file_database=True)
+    from django.contrib.auth import get_user_model
+    from journal import models
+
+    user = get_user_model().objects.create(username='bench')
+    journal = models.Journal.objects.create(owner=user, uid=random_hash(), content=b'')
+
+    results = []
+    deadline = time.perf_counter() + seconds
+    workers = [threading.Thread(target=worker, args=(user, journal.uid, deadline, results)) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    created = sum(counts['created'] for counts in results)
+    conflicts = sum(counts['conflict'] for counts in results)
+    errors = sum(counts['error'] for counts in results)
+    attempts = created + conflicts + errors
+    journal.refresh_from_db()
+    seqs = list(models.Entry.objects.filter(journal=journal).values_list('seq', flat=True))
+
+    print('threads:        {}'.format(threads))
+    print('appends/sec:    {:.1f}'.format(created / seconds))
+    print('409 rate:       {:.1%}'.format(conflicts / attempts if attempts else 0))
+    print('errors:         {}'.format(errors))
+    print('consistent:     {}'.format(seqs == list(range(1, created + 1)) and journal.entry_count == created))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 8, float(sys.argv[2]) if len(sys.argv) > 2 else 5)
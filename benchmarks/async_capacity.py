@@ -0,0 +1,252 @@
+# Copyright © 2017 Tom Hacohen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Compare how many slow clients the WSGI and ASGI paths can serve at once.
+
+Both are served over real sockets, with the same number of concurrent clients. Every client downloads a journal's
+(streamed) entries, reading CHUNK_SIZE bytes every CHUNK_DELAY seconds (a slow network). The socket buffers are
+kept small, so the server can't hand the whole response to the kernel and has to wait for the client. With WSGI a
+worker thread waits, with ASGI only the event loop does and the (equally sized) thread pool is free to serve others.
+
+The servers are minimal ones built on the standard library (wsgiref and asyncio streams), not production servers.
+Before Django 4.2 async views can't stream (see journal.async_views), so there the ASGI path sends regular responses.
+
+Run from the repository root: python -m benchmarks.async_capacity [clients] [threads]
+"""
+
+import asyncio
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+from . import random_hash, setup
+
+ENTRIES = 100
+CHUNK_SIZE = 4096
+CHUNK_DELAY = 0.005
+BUFFER_SIZE = 4096
+
+
+class Tracker:
+    """Tracks the number of connections being served at once"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.current = 0
+        self.peak = 0
+
+    def __enter__(self):
+        with self.lock:
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+
+    def __exit__(self, *args):
+        with self.lock:
+            self.current -= 1
+
+
+class QuietWSGIRequestHandler(WSGIRequestHandler):
+    def handle(self):
+        with self.server.tracker:
+            super().handle()
+
+    def log_message(self, *args):
+        pass
+
+
+class PooledWSGIServer(WSGIServer):
+    """A WSGI server handling requests with a fixed number of worker threads"""
+    request_queue_size = 1024
+
+    def __init__(self, address, threads):
+        super().__init__(address, QuietWSGIRequestHandler)
+        self.workers = ThreadPoolExecutor(max_workers=threads)
+        self.tracker = Tracker()
+
+    def get_request(self):
+        request, client_address = super().get_request()
+        request.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, BUFFER_SIZE)
+        return request, client_address
+
+    def process_request(self, request, client_address):
+        self.workers.submit(self.process_request_in_worker, request, client_address)
+
+    def process_request_in_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+class ASGIServer:
+    """An HTTP/1.0 style ASGI server (one request per connection) running its event loop in a thread"""
+
+    def __init__(self, app):
+        self.app = app
+        self.tracker = Tracker()
+        self.loop = asyncio.new_event_loop()
+        self.server = self.loop.run_until_complete(asyncio.start_server(self.handle, '127.0.0.1', 0, backlog=1024))
+        self.server_address = self.server.sockets[0].getsockname()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    async def handle(self, reader, writer):
+        with self.tracker:
+            writer.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, BUFFER_SIZE)
+            method, target, _ = (await reader.readline()).decode('latin1').split(' ', 2)
+            headers = []
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b''):
+                    break
+                name, _, value = line.decode('latin1').partition(':')
+                headers.append((name.strip().lower().encode('latin1'), value.strip().encode('latin1')))
+
+            path, _, query_string = target.partition('?')
+            scope = {
+                'type': 'http',
+                'asgi': {'version': '3.0'},
+                'http_version': '1.0',
+                'method': method,
+                'scheme': 'http',
+                'path': path,
+                'root_path': '',
+                'query_string': query_string.encode('latin1'),
+                'headers': headers,
+                'server': self.server_address,
+                'client': writer.get_extra_info('peername'),
+            }
+            disconnected = asyncio.get_running_loop().create_future()
+            messages = [{'type': 'http.request', 'body': b''}]
+
+            async def receive():
+                if messages:
+                    return messages.pop(0)
+                return await disconnected
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    writer.write('HTTP/1.0 {} -\r\n'.format(message['status']).encode('latin1'))
+                    for name, value in message.get('headers', ()):
+                        writer.write(name + b': ' + value + b'\r\n')
+                    writer.write(b'\r\n')
+                else:
+                    writer.write(message.get('body', b''))
+                await writer.drain()
+
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                disconnected.set_result({'type': 'http.disconnect'})
+                writer.close()
+
+    def shutdown(self):
+        self.loop.call_soon_threadsafe(self.server.close)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+def download(address, path, cookie):
+    """A slow client: reads the response CHUNK_SIZE bytes at a time, waiting CHUNK_DELAY after each"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, BUFFER_SIZE)
+    sock.connect(address)
+    try:
+        request = 'GET {} HTTP/1.0\r\nHost: testserver\r\nCookie: {}\r\n\r\n'.format(path, cookie)
+        sock.sendall(request.encode('latin1'))
+        response = b''
+        while True:
+            chunk = sock.recv(CHUNK_SIZE)
+            if not chunk:
+                break
+            response += chunk
+            time.sleep(CHUNK_DELAY)
+    finally:
+        sock.close()
+    status = response.split(b' ', 2)[1]
+    assert status == b'200', status
+    return len(response)
+
+
+def run_clients(clients, address, path, cookie):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        sizes = [future.result() for future in [pool.submit(download, address, path, cookie) for _ in range(clients)]]
+    return time.perf_counter() - start, max(sizes)
+
+
+def run_wsgi(clients, threads, path, cookie):
+    from django.core.wsgi import get_wsgi_application
+
+    server = PooledWSGIServer(('127.0.0.1', 0), threads)
+    server.set_app(get_wsgi_application())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        elapsed, size = run_clients(clients, server.server_address, path, cookie)
+    finally:
+        server.shutdown()
+        server.workers.shutdown()
+        server.server_close()
+    return elapsed, size, server.tracker.peak
+
+
+def run_asgi(clients, path, cookie):
+    from django.core.asgi import get_asgi_application
+
+    server = ASGIServer(get_asgi_application())
+    try:
+        elapsed, size = run_clients(clients, server.server_address, path, cookie)
+    finally:
+        server.shutdown()
+    return elapsed, size, server.tracker.peak
+
+
+def main(clients, threads):
+    setup(file_database=True)
+    from django.conf import settings
+    from django.contrib.auth import get_user_model
+    from django.test import Client
+    from django.test.utils import override_settings
+    from journal import async_views, models
+
+    user = get_user_model().objects.create(username='bench')
+    journal = models.Journal.objects.create(owner=user, uid=random_hash(), content=b'')
+    models.Entry.objects.bulk_create([models.Entry(journal=journal, uid=random_hash(), content=b'x' * 1024, seq=i + 1)
+                                      for i in range(ENTRIES)])
+
+    client = Client()
+    client.force_login(user)
+    cookie = '{}={}'.format(settings.SESSION_COOKIE_NAME, client.cookies[settings.SESSION_COOKIE_NAME].value)
+    path = '/api/v1/journal/{}/'.format(journal.uid)
+
+    with override_settings(JOURNAL_STREAM_ENTRIES=True):
+        wsgi_time, wsgi_size, wsgi_peak = run_wsgi(clients, threads, path, cookie)
+        with override_settings(ROOT_URLCONF='tests.test_async_urls', JOURNAL_ASYNC_THREADS=threads):
+            asgi_time, asgi_size, asgi_peak = run_asgi(clients, path, cookie)
+
+    print('clients: {}, threads: {}, response: {} bytes, read: {} bytes per {}s, ASGI streaming: {}'.format(
+        clients, threads, max(wsgi_size, asgi_size), CHUNK_SIZE, CHUNK_DELAY, async_views.STREAMING_SUPPORTED))
+    print('{:>6} {:>10} {:>10} {:>12}'.format('', 'time', 'req/s', 'concurrent'))
+    print('{:>6} {:>9.2f}s {:>10.1f} {:>12}'.format('WSGI', wsgi_time, clients / wsgi_time, wsgi_peak))
+    print('{:>6} {:>9.2f}s {:>10.1f} {:>12}'.format('ASGI', asgi_time, clients / asgi_time, asgi_peak))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100, int(sys.argv[2]) if len(sys.argv) > 2 else 4)
@@ -0,0 +1,63 @@
+# Copyright © 2017 Tom Hacohen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Compare the per-entry and the bulk insert paths for multi-entry uploads.
+
+Run from the repository root: python -m benchmarks.bulk_append
+"""
+
+import sys
+import time
+
+from . import random_hash, setup
+
+
+def make_data(count):
+    return [{'uid': random_hash(), 'content': 'dGVzdA=='} for _ in range(count)]
+
+
+def run(serializer, journal):
+    from django.db import transaction
+    start = time.perf_counter()
+    with transaction.atomic():
+        serializer.is_valid(raise_exception=True)
+        serializer.save(journal=journal)
+    return time.perf_counter() - start
+
+
+def main(sizes):
+    setup()
+    from django.contrib.auth import get_user_model
+    from rest_framework import serializers as rest_serializers
+    from journal import models, serializers
+
+    user = get_user_model().objects.create(username='bench')
+
+    print('{:>8} {:>12} {:>12} {:>8}'.format('entries', 'per-entry', 'bulk', 'speedup'))
+    for size in sizes:
+        data = make_data(size)
+        journal = models.Journal.objects.create(owner=user, uid=random_hash(), content=b'')
+        old = rest_serializers.ListSerializer(child=serializers.EntrySerializer(), data=data)
+        old_time = run(old, journal)
+
+        data = make_data(size)
+        journal = models.Journal.objects.create(owner=user, uid=random_hash(), content=b'')
+        new = serializers.EntrySerializer(data=data, many=True)
+        new_time = run(new, journal)
+
+        print('{:>8} {:>11.3f}s {:>11.3f}s {:>7.1f}x'.format(size, old_time, new_time, old_time / new_time))
+
+
+if __name__ == '__main__':
+    main([int(x) for x in sys.argv[1:]] or [10, 1000, 10000])
@@ -0,0 +1,85 @@
+# Copyright © 2017 Tom Hacohen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""A reproducible synthetic dataset: the same parameters and seed always generate the same data."""
+
+import hashlib
+import random
+
+
+class Dataset:
+    def __init__(self, users, journals_per_user=5, members_per_journal=1, entries_per_journal=100, entry_size=512,
+                 seed=0):
+        self.params = {
+            'users': users,
+            'journals_per_user': journals_per_user,
+            'members_per_journal': members_per_journal,
+            'entries_per_journal': entries_per_journal,
+            'entry_size': entry_size,
+            'seed': seed,
+        }
+        self.random = random.Random(seed)
+        self.counter = 0
+        self.users = []
+        # {user id: [journal, ...]} of the journals each user owns
+        self.journals = {}
+
+    def make_hash(self):
+        self.counter += 1
+        return hashlib.sha256('{}:{}'.format(self.params['seed'], self.counter).encode('ascii')).hexdigest()
+
+    def make_content(self, size):
+        return bytes(self.random.getrandbits(8) for _ in range(size))
+
+    def generate(self, batch_size=1000):
+        """Create the dataset in the (empty) database"""
+        from django.contrib.auth import get_user_model
+        from journal import models
+
+        User = get_user_model()
+        params = self.params
+
+        User.objects.bulk_create([
+            User(username='bench{}'.format(i), email='bench{}@localhost'.format(i)) for i in range(params['users'])])
+        # Re-read them, not all databases return the ids from bulk inserts
+        self.users = list(User.objects.filter(username__startswith='bench').order_by('pk'))
+        models.UserInfo.objects.bulk_create([
+            models.UserInfo(owner=user, pubkey=self.make_content(32), content=self.make_content(256))
+            for user in self.users])
+
+        journals = [models.Journal(owner=user, uid=self.make_hash(), content=self.make_content(256))
+                    for user in self.users for _ in range(params['journals_per_user'])]
+        models.Journal.objects.bulk_create(journals, batch_size=batch_size)
+        journals = list(models.Journal.objects.filter(owner__in=self.users).order_by('pk'))
+
+        members = []
+        for journal in journals:
+            others = [user for user in self.users if user.pk != journal.owner_id]
+            for user in self.random.sample(others, min(params['members_per_journal'], len(others))):
+                members.append(models.JournalMember(journal=journal, user=user, key=self.make_content(32)))
+        models.JournalMember.objects.bulk_create(members, batch_size=batch_size)
+
+        # Content is generated once per journal and reused, generating it per entry would dominate the setup time
+        for journal in journals:
+            content = self.make_content(params['entry_size'])
+            entries = [models.Entry(journal=journal, uid=self.make_hash(), content=content, seq=seq)
+                       for seq in range(1, params['entries_per_journal'] + 1)]
+            models.Entry.objects.bulk_create(entries, batch_size=batch_size)
+            if len(entries) > 0:
+                last = models.Entry.objects.filter(journal=journal).order_by('-id').first()
+                models.Journal.objects.filter(pk=journal.pk).update(last_entry=last, seq=len(entries),
+                                                                    entry_count=len(entries))
+            self.journals.setdefault(journal.owner_id, []).append(journal)
+
+        return self
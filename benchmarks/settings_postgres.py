@@ -0,0 +1,30 @@
+# Copyright © 2017 Tom Hacohen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# The test settings, but with a local PostgreSQL database (needs psycopg2)
+
+import os
+
+from tests.test_settings import *  # noqa: F401,F403
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('BENCHMARK_PG_NAME', 'journal_benchmark'),
+        'USER': os.environ.get('BENCHMARK_PG_USER', ''),
+        'PASSWORD': os.environ.get('BENCHMARK_PG_PASSWORD', ''),
+        'HOST': os.environ.get('BENCHMARK_PG_HOST', 'localhost'),
+        'PORT': os.environ.get('BENCHMARK_PG_PORT', '5432'),
+    }
+}
@@ -0,0 +1,165 @@
+# Copyright © 2017 Tom Hacohen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmarks of the main endpoints against a synthetic dataset, reporting JSON.
+
+For every scenario we report latency percentiles, queries and bytes per request. Runs against SQLite by default,
+pass --postgres to use a local PostgreSQL (configured with the BENCHMARK_PG_* environment variables, see
+benchmarks/settings_postgres.py).
+
+Run from the repository root: python -m benchmarks.suite [--help]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+from . import setup
+from .dataset import Dataset
+
+
+def percentile(values, percent):
+    """Nearest rank percentile of the sorted values"""
+    index = max(0, int(round(percent / 100 * len(values))) - 1)
+    return values[index]
+
+
+def measure(client, request, iterations):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    latencies = []
+    queries = []
+    sizes = []
+    for i in range(iterations):
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            response = request(client, i)
+            content = b''.join(response.streaming_content) if response.streaming else response.content
+            latencies.append((time.perf_counter() - start) * 1000)
+        assert response.status_code < 300, (response.status_code, content[:200])
+        queries.append(len(context))
+        sizes.append(len(content))
+
+    latencies.sort()
+    return {
+        'iterations': iterations,
+        'latency_ms': {
+            'p50': percentile(latencies, 50),
+            'p90': percentile(latencies, 90),
+            'p99': percentile(latencies, 99),
+            'mean': sum(latencies) / len(latencies),
+        },
+        'queries': {'mean': sum(queries) / len(queries), 'max': max(queries)},
+        'bytes': {'mean': sum(sizes) / len(sizes), 'max': max(sizes)},
+    }
+
+
+def get_scenarios(dataset):
+    from django.urls import reverse
+    from journal import models
+
+    user = dataset.users[0]
+    journal = dataset.journals[user.pk][0]
+    entries_url = reverse('journal-entries-list', kwargs={'journal_uid': journal.uid})
+    entry_uids = list(models.Entry.objects.filter(journal=journal).values_list('uid', flat=True))
+    incremental_last = entry_uids[max(0, len(entry_uids) - 10)] if len(entry_uids) > 0 else None
+    append_journal = models.Journal.objects.create(owner=user, uid=dataset.make_hash(), content=b'bench')
+    append_url = reverse('journal-entries-list', kwargs={'journal_uid': append_journal.uid})
+    append_state = {'last': None}
+
+    def bulk_append(client, i):
+        entries = [{'uid': dataset.make_hash(), 'content': 'YmVuY2g='} for _ in range(100)]
+        query = '?last={}'.format(append_state['last']) if append_state['last'] is not None else ''
+        response = client.post(append_url + query, json.dumps(entries), content_type='application/json')
+        append_state['last'] = entries[-1]['uid']
+        return response
+
+    def incremental_fetch(client, i):
+        if incremental_last is None:
+            return client.get(entries_url)
+        return client.get(entries_url + '?last={}'.format(incremental_last))
+
+    return {
+        'journal_list': lambda client, i: client.get(reverse('journal-list')),
+        'entries_full': lambda client, i: client.get(entries_url),
+        'entries_incremental': incremental_fetch,
+        'bulk_append': bulk_append,
+        'members_list': lambda client, i: client.get(reverse('journal-members-list',
+                                                             kwargs={'journal_uid': journal.uid})),
+        'user_info': lambda client, i: client.get(reverse('userinfo-detail',
+                                                          kwargs={'username': dataset.users[-1].username})),
+    }
+
+
+def run(args):
+    if args.postgres:
+        os.environ['DJANGO_SETTINGS_MODULE'] = 'benchmarks.settings_postgres'
+    setup()
+
+    import django
+    from django.db import connection
+    from rest_framework.test import APIClient
+
+    dataset = Dataset(users=args.users, journals_per_user=args.journals_per_user,
+                      members_per_journal=args.members_per_journal, entries_per_journal=args.entries_per_journal,
+                      entry_size=args.entry_size, seed=args.seed).generate()
+
+    client = APIClient()
+    client.force_authenticate(user=dataset.users[0])
+
+    scenarios = get_scenarios(dataset)
+    selected = args.scenario or list(scenarios.keys())
+    results = {}
+    for name in selected:
+        request = scenarios[name]
+        # Warm up (connections, caches, lazily compiled code)
+        request(client, -1)
+        results[name] = measure(client, request, args.iterations)
+
+    return {
+        'dataset': dataset.params,
+        'database': connection.vendor,
+        'django': django.get_version(),
+        'iterations': args.iterations,
+        'results': results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--journals-per-user', type=int, default=5)
+    parser.add_argument('--members-per-journal', type=int, default=1)
+    parser.add_argument('--entries-per-journal', type=int, default=100)
+    parser.add_argument('--entry-size', type=int, default=512, help='Entry content size in bytes')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--iterations', type=int, default=50, help='Requests per scenario')
+    parser.add_argument('--scenario', action='append', help='Only run this scenario (can be repeated)')
+    parser.add_argument('--postgres', action='store_true', help='Run against a local PostgreSQL')
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+    args = parser.parse_args(argv)
+
+    report = json.dumps(run(args), indent=2, sort_keys=True)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    else:
+        sys.stdout.write(report + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+# Copyright © 2017 Tom Hacohen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import uuid
+
+from django.core.cache import caches
+from django.db import router, transaction
+from django.db.models import Exists, OuterRef, Q, Subquery
+from django.utils.functional import cached_property
+
+from . import app_settings
+from .models import Journal, JournalMember
+
+
+class JournalAccess:
+    """
+    The requesting user's access to a journal. Resolved once per request and shared by the permissions and the views.
+
+    The journal itself is only fetched when needed, so permission checks can be answered from the access cache.
+    """
+
+    def __init__(self, journal_id, is_owner, is_member, read_only, get_journal):
+        self.journal_id = journal_id
+        self.is_owner = is_owner
+        self.is_member = is_member
+        self.read_only = read_only
+        self._get_journal = get_journal
+
+    @cached_property
+    def journal(self):
+        return self._get_journal()
+
+
+def filter_accessible(queryset, user):
+    """Filter a Journal queryset to the journals the user owns or is a member of
+
+    Membership is checked with EXISTS rather than joining the members, so every journal is only returned once
+    without needing a DISTINCT over all of the (blob) columns.
+    """
+    memberships = JournalMember.objects.filter(journal=OuterRef('pk'), user=user)
+    return queryset.filter(Q(owner=user) | Exists(memberships), deleted=False)
+
+
+def annotate_membership(queryset, user):
+    memberships = JournalMember.objects.filter(journal=OuterRef('pk'), user=user)
+    return queryset.annotate(member_read_only=Subquery(memberships.values('readOnly')[:1]))
+
+
+# The access cache maps a user to {journal uid: (journal id, is owner, is member, read only)} for every journal
+# the user can access. Invalidating replaces the user's version once the change is committed, so a map built
+# concurrently with a change is stored under a stale key and never used.
+
+def is_cache_enabled():
+    return app_settings.ACCESS_CACHE is not None
+
+
+def _get_cache():
+    return caches[app_settings.ACCESS_CACHE]
+
+
+def _version_key(user_id):
+    return 'journal:access-version:{}'.format(user_id)
+
+
+def get_access_map(user):
+    cache = _get_cache()
+    version = cache.get_or_set(_version_key(user.pk), lambda: uuid.uuid4().hex, None)
+    key = 'journal:access:{}:{}'.format(user.pk, version)
+
+    access_map = cache.get(key)
+    if access_map is None:
+        # It's kept for a while, so read it from the primary rather than from a (possibly lagging) read replica
+        primary = Journal.objects.db_manager(router.db_for_write(Journal))
+        journals = annotate_membership(filter_accessible(primary, user), user)
+        access_map = {
+            uid: (journal_id, owner_id == user.pk, member_read_only is not None, bool(member_read_only))
+            for journal_id, uid, owner_id, member_read_only
+            in journals.values_list('pk', 'uid', 'owner_id', 'member_read_only')
+        }
+        cache.set(key, access_map, app_settings.ACCESS_CACHE_TIMEOUT)
+
+    return access_map
+
+
+def invalidate(user_ids):
+    if not is_cache_enabled():
+        return
+
+    user_ids = list(user_ids)
+
+    def bump_versions():
+        _get_cache().set_many({_version_key(user_id): uuid.uuid4().hex for user_id in user_ids}, None)
+
+    # Only once committed, otherwise a map built from the data before the change could be cached under the new version
+    transaction.on_commit(bump_versions, using=router.db_for_write(Journal))
+
+
+def journal_saved(sender, instance, created, **kwargs):
+    if created:
+        invalidate([instance.owner_id])
+    elif instance.deleted and is_cache_enabled():
+        members = JournalMember.objects.filter(journal=instance).values_list('user_id', flat=True)
+        invalidate([instance.owner_id] + list(members))
+
+
+def journal_deleted(sender, instance, **kwargs):
+    # Members are deleted (and invalidated) by the cascade
+    invalidate([instance.owner_id])
+
+
+def member_changed(sender, instance, **kwargs):
+    invalidate([instance.user_id])
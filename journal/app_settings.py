@@ -48,6 +48,109 @@ class AppSettings:
             ret.append(self.import_from_str(perm))
         return ret
 
+    @property
+    def MAX_PAGE_SIZE(self):
+        return self._setting("MAX_PAGE_SIZE", 1000)
+
+    @property
+    def SYNC_MAX_JOURNALS(self):
+        # The most journals a single journals/sync/ request can ask for
+        return self._setting("SYNC_MAX_JOURNALS", 100)
+
+    @property
+    def SYNC_MAX_ENTRIES(self):
+        # The most entries a single journals/sync/ response holds (all journals together)
+        return self._setting("SYNC_MAX_ENTRIES", 5000)
+
+    @property
+    def STREAM_ENTRIES(self):
+        return self._setting("STREAM_ENTRIES", False)
+
+    @property
+    def STREAM_CHUNK_SIZE(self):
+        return self._setting("STREAM_CHUNK_SIZE", 500)
+
+    @property
+    def BULK_CREATE_BATCH_SIZE(self):
+        return self._setting("BULK_CREATE_BATCH_SIZE", 1000)
+
+    @property
+    def ACCESS_CACHE(self):
+        # The alias of the cache (from CACHES) to use for the access cache, or None to disable it
+        return self._setting("ACCESS_CACHE", None)
+
+    @property
+    def ACCESS_CACHE_TIMEOUT(self):
+        return self._setting("ACCESS_CACHE_TIMEOUT", 300)
+
+    @property
+    def NOTIFICATION_BACKEND(self):
+        return self._setting("NOTIFICATION_BACKEND", 'journal.notifications.InProcessNotificationBackend')
+
+    @property
+    def NOTIFICATION_TIMEOUT(self):
+        # The longest (in seconds) a request waits for changes
+        return self._setting("NOTIFICATION_TIMEOUT", 30)
+
+    @property
+    def NOTIFICATION_POLL_INTERVAL(self):
+        return self._setting("NOTIFICATION_POLL_INTERVAL", 1)
+
+    @property
+    def ASYNC_THREADS(self):
+        # The size of the thread pool async views run their database access in (0 for Django's default)
+        return self._setting("ASYNC_THREADS", 10)
+
+    @property
+    def ASYNC_LONG_POLL_THREADS(self):
+        # The size of the separate thread pool long polls (journals/changes/) run in under ASGI, which limits the
+        # number of concurrently waiting long polls (further ones are queued)
+        return self._setting("ASYNC_LONG_POLL_THREADS", 100)
+
+    @property
+    def PRUNE_SNAPSHOT_ENTRIES(self):
+        # Delete the entries superseded by snapshots (done by the purge_deleted_journals command). Devices that
+        # haven't synced past them then have to start over from the snapshot.
+        return self._setting("PRUNE_SNAPSHOT_ENTRIES", False)
+
+    @property
+    def SERVER_TIMING(self):
+        # Time the database, serialization and rendering of every request, see journal.timing
+        return self._setting("SERVER_TIMING", False)
+
+    @property
+    def METRICS(self):
+        # Collect the request and append metrics, see journal.metrics
+        return self._setting("METRICS", False)
+
+    @property
+    def THROTTLE_RATE(self):
+        # The tokens (e.g. entries) per second CostThrottle refills the buckets with
+        return self._setting("THROTTLE_RATE", 100)
+
+    @property
+    def THROTTLE_BURST(self):
+        # The most tokens a CostThrottle bucket holds
+        return self._setting("THROTTLE_BURST", 10000)
+
+    @property
+    def THROTTLE_CACHE(self):
+        return self._setting("THROTTLE_CACHE", 'default')
+
+    @property
+    def READ_REPLICAS(self):
+        # The aliases (from DATABASES) of the read replicas, see journal.routers
+        return self._setting("READ_REPLICAS", ())
+
+    @property
+    def READ_REPLICAS_STICKY_TIME(self):
+        # How long (in seconds) a user's reads go to the primary after they write
+        return self._setting("READ_REPLICAS_STICKY_TIME", 10)
+
+    @property
+    def READ_REPLICAS_CACHE(self):
+        return self._setting("READ_REPLICAS_CACHE", 'default')
+
 
 # Ugly? Guido recommends this himself ...
 # http://mail.python.org/pipermail/python-ideas/2012-May/014969.html
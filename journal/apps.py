@@ -17,3 +17,13 @@ from django.apps import AppConfig
 
 class JournalConfig(AppConfig):
     name = 'journal'
+
+    def ready(self):
+        from django.db.models.signals import post_save, post_delete
+        from . import access
+        from .models import Journal, JournalMember
+
+        post_save.connect(access.journal_saved, sender=Journal)
+        post_delete.connect(access.journal_deleted, sender=Journal)
+        post_save.connect(access.member_changed, sender=JournalMember)
+        post_delete.connect(access.member_changed, sender=JournalMember)
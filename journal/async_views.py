@@ -0,0 +1,140 @@
+# Copyright © 2017 Tom Hacohen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from django.urls import URLPattern
+
+from . import app_settings
+from .views import EntryViewSet, JournalViewSet, SnapshotViewSet, UserInfoViewSet
+
+# The read heavy viewsets, served asynchronously by AsyncRouterMixin
+ASYNC_VIEWSETS = (EntryViewSet, JournalViewSet, SnapshotViewSet, UserInfoViewSet)
+
+# Whether async views can send streaming responses
+STREAMING_SUPPORTED = django.VERSION >= (4, 2)
+
+_executors = {}
+_executor_lock = threading.Lock()
+_end = object()
+
+
+def _get_executor(name, max_workers):
+    with _executor_lock:
+        if name not in _executors:
+            _executors[name] = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        return _executors[name]
+
+
+def get_executor():
+    return _get_executor('journal-db', app_settings.ASYNC_THREADS)
+
+
+def get_long_poll_executor():
+    return _get_executor('journal-long-poll', app_settings.ASYNC_LONG_POLL_THREADS)
+
+
+def _run_with_connections(func, *args, **kwargs):
+    # The pool's threads don't get the request signals, so manage their connections like a request would
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_in_executor(executor, func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(_run_with_connections, func, *args, **kwargs))
+
+
+async def run_in_pool(func, *args, **kwargs):
+    """Run blocking (database) code in the bounded pool without blocking the event loop"""
+    if app_settings.ASYNC_THREADS == 0:
+        # Django's default: everything in one thread (e.g. for tests, which need the test case's connection)
+        return await sync_to_async(func, thread_sensitive=True)(*args, **kwargs)
+
+    return await run_in_executor(get_executor(), func, *args, **kwargs)
+
+
+async def run_long_poll(func, *args, **kwargs):
+    """Run code that blocks for long (without using the database meanwhile) in a pool of its own
+
+    Never in Django's single thread for sync code (not even with JOURNAL_ASYNC_THREADS = 0), as that would hold up
+    every other request, and not in the pool of the other views, as it would starve them.
+    """
+    return await run_in_executor(get_long_poll_executor(), func, *args, **kwargs)
+
+
+async def _iterate_in_pool(iterator):
+    while True:
+        chunk = await run_in_pool(next, iterator, _end)
+        if chunk is _end:
+            return
+        yield chunk
+
+
+def as_async_view(view, run=run_in_pool):
+    """Wrap a view so it runs in the pool (or using run), leaving the event loop to send the response
+
+    Streaming responses are produced chunk by chunk in the pool. This needs Django 4.2 or newer, before that streaming
+    responses could only be sent by iterating them on the event loop (where we can't access the database). So with
+    older versions the views return regular responses instead (see JOURNAL_STREAM_ENTRIES), which hold all of the
+    content in memory.
+    """
+    @functools.wraps(view)
+    async def async_view(request, *args, **kwargs):
+        if not STREAMING_SUPPORTED:
+            request.streaming_supported = False
+
+        response = await run(view, request, *args, **kwargs)
+        if callable(getattr(response, 'render', None)):
+            response = await run(response.render)
+
+        if response.streaming:
+            response.streaming_content = _iterate_in_pool(iter(response))
+
+        return response
+
+    return async_view
+
+
+class AsyncRouterMixin:
+    """Serves the routes of the async_viewsets through async views, for ASGI deployments
+
+    e.g. class Router(AsyncRouterMixin, routers.DefaultRouter): pass
+    """
+    async_viewsets = ASYNC_VIEWSETS
+    # Block for up to JOURNAL_NOTIFICATION_TIMEOUT, so they're run by run_long_poll
+    long_poll_actions = ('changes', )
+
+    def get_urls(self):
+        return [self.get_async_url(url) for url in super().get_urls()]
+
+    def get_async_url(self, url):
+        viewset = getattr(getattr(url, 'callback', None), 'cls', None)
+        if isinstance(url, URLPattern) and viewset is not None and issubclass(viewset, self.async_viewsets):
+            actions = getattr(url.callback, 'actions', {}).values()
+            if any(action in self.long_poll_actions for action in actions):
+                callback = as_async_view(url.callback, run=run_long_poll)
+            else:
+                callback = as_async_view(url.callback)
+            return URLPattern(url.pattern, callback, url.default_args, url.name)
+        return url
@@ -0,0 +1,55 @@
+# Copyright © 2017 Tom Hacohen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from journal import app_settings, purge
+
+
+class Command(BaseCommand):
+    help = 'Permanently delete journals (and their entries) that were deleted more than a grace period ago, ' \
+        'and the entries superseded by snapshots if JOURNAL_PRUNE_SNAPSHOT_ENTRIES is enabled.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-days', type=float, default=30,
+                            help='Only purge journals deleted more than this many days ago (default: 30).')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='The number of entries to delete per transaction (default: 1000).')
+        parser.add_argument('--throttle', type=float, default=0.1,
+                            help='Seconds to sleep between batches (default: 0.1).')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report the number of journals that would be purged.')
+
+    def handle(self, *args, **options):
+        grace_period = datetime.timedelta(days=options['grace_days'])
+
+        if options['dry_run']:
+            count = purge.get_purgeable_journals(grace_period).count()
+            self.stdout.write('{} journals would be purged.'.format(count))
+            return
+
+        def progress(journal, deleted):
+            if options['verbosity'] >= 2:
+                self.stdout.write('{}: {} entries deleted'.format(journal, deleted))
+
+        journals, entries = purge.purge_deleted_journals(grace_period, batch_size=options['batch_size'],
+                                                         throttle=options['throttle'], progress=progress)
+        self.stdout.write(self.style.SUCCESS('Purged {} journals ({} entries).'.format(journals, entries)))
+
+        if app_settings.PRUNE_SNAPSHOT_ENTRIES:
+            entries = purge.prune_superseded_entries(batch_size=options['batch_size'], throttle=options['throttle'],
+                                                     progress=progress)
+            self.stdout.write(self.style.SUCCESS('Pruned {} entries superseded by snapshots.'.format(entries)))
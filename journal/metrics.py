@@ -0,0 +1,203 @@
+# Copyright © 2017 Tom Hacohen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""In process metrics (counters and histograms), exposed in the Prometheus text format by metrics_view
+
+Collected when JOURNAL_METRICS is enabled. Every process (worker) has its own registry, so each of them has to be
+scraped. metrics_view doesn't do any authentication, so only route it where it's not publicly reachable.
+"""
+
+import bisect
+import collections
+import threading
+
+from django.http import HttpResponse
+
+# In seconds
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# 1KiB to 16MiB
+BYTES_BUCKETS = tuple(1024 * 4 ** i for i in range(8))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if len(labels) == 0:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, _escape(value)) for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return '+Inf' if value == float('inf') else repr(value)
+    return str(value)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError('{} takes the labels {}'.format(self.name, ', '.join(self.labelnames)))
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def clear(self):
+        with self._lock:
+            self._values = {}
+
+    def get_samples(self):
+        """[(name, ((label, value), ...), value), ...] of the current values"""
+        raise NotImplementedError()
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} {}'.format(self.name, self.type)]
+        for name, labels, value in self.get_samples():
+            lines.append('{}{} {}'.format(name, _format_labels(labels), _format_value(value)))
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def get_samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [(self.name, tuple(zip(self.labelnames, key)), value) for key, value in values]
+
+
+class Histogram(Metric):
+    """Counts observations in fixed buckets, the upper bounds (inclusive) of which are buckets"""
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        # The last bucket is +Inf
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key, None)
+            if counts is None:
+                # The bucket counts followed by the sum of the observations
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def get_samples(self):
+        with self._lock:
+            values = sorted((key, list(counts)) for key, counts in self._values.items())
+
+        samples = []
+        for key, counts in values:
+            labels = tuple(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'), ), counts):
+                cumulative += count
+                samples.append((self.name + '_bucket', labels + (('le', _format_value(bound)), ), cumulative))
+            samples.append((self.name + '_sum', labels, counts[-1]))
+            samples.append((self.name + '_count', labels, cumulative))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = collections.OrderedDict()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError('{} is already registered'.format(metric.name))
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def clear(self):
+        """Reset all of the values (the metrics stay registered)"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            metric.clear()
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return ''.join(metric.render() + '\n' for metric in metrics)
+
+
+registry = Registry()
+
+REQUESTS = registry.counter(
+    'journal_requests_total', 'Requests handled, by viewset, action and status code.',
+    ('viewset', 'action', 'status'))
+REQUEST_DURATION = registry.histogram(
+    'journal_request_duration_seconds', 'Time spent handling requests (streamed content excluded).',
+    ('viewset', 'action'))
+RESPONSE_BYTES = registry.histogram(
+    'journal_response_bytes', 'Size of the response bodies.', ('viewset', 'action'), BYTES_BUCKETS)
+APPEND_CONFLICTS = registry.counter(
+    'journal_append_conflicts_total',
+    'Appends rejected (409) because the journal has newer entries, by whether the client was already outdated '
+    '(stale) or lost a race with another append (race).', ('reason', ))
+APPEND_LOCK_WAIT = registry.histogram(
+    'journal_append_lock_wait_seconds', 'Time spent claiming (and locking) the journal when appending.')
+
+
+def _count_streamed(content, labels):
+    size = 0
+    for chunk in content:
+        size += len(chunk)
+        yield chunk
+    RESPONSE_BYTES.observe(size, **labels)
+
+
+def observe_response(view, response, duration):
+    """Record a viewset's response, duration is how long producing it took (in seconds)"""
+    labels = {'viewset': type(view).__name__, 'action': getattr(view, 'action', None) or 'unknown'}
+    REQUESTS.inc(status=response.status_code, **labels)
+    REQUEST_DURATION.observe(duration, **labels)
+    if response.streaming:
+        # Counted once fully sent
+        response.streaming_content = _count_streamed(response.streaming_content, labels)
+    else:
+        RESPONSE_BYTES.observe(len(response.content), **labels)
+
+
+def metrics_view(request):
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,34 @@
+# Generated by Django 3.2.25 on 2026-10-16 19:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_last_entry(apps, schema_editor):
+    Journal = apps.get_model('journal', 'Journal')
+    Entry = apps.get_model('journal', 'Entry')
+
+    stats = Entry.objects.order_by().values('journal').annotate(count=models.Count('id'), last=models.Max('id'))
+    for stat in stats.iterator():
+        Journal.objects.filter(pk=stat['journal']).update(entry_count=stat['count'], last_entry_id=stat['last'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('journal', '0010_journalmember_readonly'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='journal',
+            name='entry_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='journal',
+            name='last_entry',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='journal.entry'),
+        ),
+        migrations.RunPython(backfill_last_entry, migrations.RunPython.noop),
+    ]
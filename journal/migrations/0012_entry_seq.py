@@ -0,0 +1,43 @@
+# Generated by Django 3.2.25 on 2026-10-17 09:12
+
+from django.db import migrations, models
+
+
+def backfill_seq(apps, schema_editor):
+    Journal = apps.get_model('journal', 'Journal')
+    Entry = apps.get_model('journal', 'Entry')
+
+    journal_ids = Entry.objects.order_by().values_list('journal', flat=True).distinct()
+    for journal_id in journal_ids.iterator():
+        entries = []
+        for seq, pk in enumerate(Entry.objects.filter(journal=journal_id).order_by('id').values_list('pk', flat=True),
+                                 start=1):
+            entries.append(Entry(pk=pk, seq=seq))
+        Entry.objects.bulk_update(entries, ['seq'], batch_size=1000)
+        Journal.objects.filter(pk=journal_id).update(seq=len(entries))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('journal', '0011_journal_last_entry_entry_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='journal',
+            name='seq',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='entry',
+            name='seq',
+            field=models.PositiveIntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_seq, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='entry',
+            constraint=models.UniqueConstraint(fields=('journal', 'seq'), name='journal_entry_journal_seq_unique'),
+        ),
+    ]
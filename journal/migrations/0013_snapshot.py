@@ -0,0 +1,27 @@
+# Generated by Django 3.2.25 on 2026-10-16 19:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('journal', '0012_entry_seq'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Snapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content', models.BinaryField(editable=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('entry', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='journal.entry')),
+                ('journal', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='journal.journal')),
+            ],
+            options={
+                'ordering': ['entry_id'],
+            },
+        ),
+    ]
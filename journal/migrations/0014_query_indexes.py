@@ -0,0 +1,58 @@
+# Generated by Django 3.2.25 on 2026-10-17 10:41
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_username_index(apps, schema_editor):
+    # User info is looked up by username__iexact, which PostgreSQL runs as UPPER(username) = UPPER(%s). The user
+    # model belongs to another app, so the index has to be created by hand. Other databases either compare case
+    # insensitively already (MySQL) or can't use an index for it anyway (SQLite's LIKE).
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    quote_name = schema_editor.quote_name
+    schema_editor.execute('CREATE INDEX IF NOT EXISTS {} ON {} (UPPER({}::text))'.format(
+        quote_name('journal_user_username_upper_idx'),
+        quote_name(User._meta.db_table),
+        quote_name(User._meta.get_field(User.USERNAME_FIELD).column),
+    ))
+
+
+def drop_username_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    schema_editor.execute('DROP INDEX IF EXISTS {}'.format(schema_editor.quote_name('journal_user_username_upper_idx')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('journal', '0013_snapshot'),
+    ]
+
+    operations = [
+        # Create the composite index before dropping the one it replaces
+        migrations.AddIndex(
+            model_name='entry',
+            index=models.Index(fields=['journal', 'id'], name='journal_entry_journal_id_idx'),
+        ),
+        migrations.AlterField(
+            model_name='entry',
+            name='journal',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='journal.journal'),
+        ),
+        migrations.AddIndex(
+            model_name='journal',
+            index=models.Index(condition=models.Q(('deleted', False)), fields=['owner'], name='journal_live_owner_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='journalmember',
+            index=models.Index(fields=['user', 'journal', 'readOnly'], name='journal_member_access_idx'),
+        ),
+        migrations.RunPython(create_username_index, drop_username_index),
+    ]
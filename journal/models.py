@@ -12,7 +12,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 from django.core.validators import RegexValidator
 
@@ -20,6 +20,12 @@ from django.core.validators import RegexValidator
 Sha256Validator = RegexValidator(regex=r'[a-fA-F0-9]{64}', message='Not a sha256 value.')
 
 
+class MetadataQuerySet(models.QuerySet):
+    def metadata(self):
+        """Don't load the (potentially large) content, for when only the metadata is needed"""
+        return self.defer('content')
+
+
 class Journal(models.Model):
     uid = models.CharField(db_index=True, blank=False, null=False,
                            max_length=64, validators=[Sha256Validator])
@@ -28,9 +34,20 @@ class Journal(models.Model):
     content = models.BinaryField(editable=True, blank=False, null=False)
     modified = models.DateTimeField(auto_now=True)
     deleted = models.BooleanField(default=False)
+    # Denormalized from Entry so we don't need to scan the entries to find them. Kept up to date by Entry.save.
+    last_entry = models.ForeignKey('Entry', null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    entry_count = models.PositiveIntegerField(default=0)
+    # The sequence number of the last entry
+    seq = models.PositiveIntegerField(default=0)
+
+    objects = MetadataQuerySet.as_manager()
 
     class Meta:
         unique_together = ('uid', 'owner')
+        indexes = [
+            # Listing only ever looks at the live journals
+            models.Index(fields=['owner'], condition=models.Q(deleted=False), name='journal_live_owner_idx'),
+        ]
 
     def __str__(self):
         return "Journal<{}>".format(self.uid)
@@ -40,16 +57,58 @@ class Entry(models.Model):
     uid = models.CharField(db_index=True, blank=False, null=False,
                            max_length=64, validators=[Sha256Validator])
     content = models.BinaryField(editable=True, blank=False, null=False)
-    journal = models.ForeignKey(Journal, on_delete=models.CASCADE)
+    # Indexed by the (journal, id) index below
+    journal = models.ForeignKey(Journal, on_delete=models.CASCADE, db_index=False)
+    # Increases by one with every entry added to the journal
+    seq = models.PositiveIntegerField()
+
+    objects = MetadataQuerySet.as_manager()
 
     class Meta:
         unique_together = ('uid', 'journal')
         ordering = ['id']
+        constraints = [
+            models.UniqueConstraint(fields=['journal', 'seq'], name='journal_entry_journal_seq_unique'),
+        ]
+        indexes = [
+            # Entries are always fetched by journal in id order
+            models.Index(fields=['journal', 'id'], name='journal_entry_journal_id_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            return super().save(*args, **kwargs)
+
+        # No savepoint needed when called within a transaction (e.g. EntryViewSet.create), as it's all or nothing
+        with transaction.atomic(savepoint=False):
+            # Callers holding the journal lock (e.g. EntryViewSet.create) already know the next seq,
+            # otherwise take it from the journal. The update locks the journal row until we're done.
+            if self.seq is None:
+                Journal.objects.filter(pk=self.journal_id).update(seq=models.F('seq') + 1)
+                self.seq = Journal.objects.values_list('seq', flat=True).get(pk=self.journal_id)
+
+            super().save(*args, **kwargs)
+            Journal.objects.filter(pk=self.journal_id).update(last_entry=self, seq=self.seq,
+                                                             entry_count=models.F('entry_count') + 1)
 
     def __str__(self):
         return "Entry<{}>".format(self.uid)
 
 
+class Snapshot(models.Model):
+    """An opaque (encrypted) snapshot of a journal, covering all of the entries up to and including entry"""
+    journal = models.ForeignKey(Journal, on_delete=models.CASCADE, related_name='snapshots')
+    entry = models.ForeignKey(Entry, on_delete=models.CASCADE, related_name='+')
+    content = models.BinaryField(editable=True, blank=False, null=False)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['entry_id']
+
+    def __str__(self):
+        return "Snapshot<{}>".format(self.entry_id)
+
+
 class JournalMember(models.Model):
     journal = models.ForeignKey(Journal, on_delete=models.CASCADE, related_name="members")
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
@@ -58,6 +117,10 @@ class JournalMember(models.Model):
 
     class Meta:
         unique_together = ('user', 'journal')
+        indexes = [
+            # Covers the access checks, which look up the user's membership (and whether it's read only)
+            models.Index(fields=['user', 'journal', 'readOnly'], name='journal_member_access_idx'),
+        ]
 
     def __str__(self):
         return "JournalMember<{}>".format(self.user)
@@ -0,0 +1,107 @@
+# Copyright © 2017 Tom Hacohen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import threading
+import time
+
+from . import app_settings
+from .models import Journal
+
+
+class BaseNotificationBackend:
+    """Lets requests wait for new entries in journals
+
+    Journals are tracked by their seq, which increases with every append.
+    """
+
+    def publish(self, journal_id, seq):
+        """Announce that the journal's seq is now seq (called after the append is committed)"""
+        raise NotImplementedError()
+
+    def wait(self, seqs, timeout):
+        """Block until one of the journals in seqs ({journal_id: seq}) is past its seq, or until the timeout
+
+        Returns the ids of the journals that changed (possibly more than actually did), or an empty set on timeout.
+        """
+        raise NotImplementedError()
+
+
+class InProcessNotificationBackend(BaseNotificationBackend):
+    """Notifications between the threads of a single process
+
+    Appends made by other processes (workers) are not seen, use DatabasePollingNotificationBackend for those.
+
+    Only the latest seqs of the max_journals most recently appended to journals are kept. A request only misses an
+    append if that many other journals are appended to between it reading the seqs and starting to wait, and then
+    it just waits until its timeout.
+    """
+    max_journals = 10000
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.latest = collections.OrderedDict()
+
+    def publish(self, journal_id, seq):
+        with self.condition:
+            if seq > self.latest.get(journal_id, 0):
+                self.latest[journal_id] = seq
+                self.latest.move_to_end(journal_id)
+            while len(self.latest) > self.max_journals:
+                self.latest.popitem(last=False)
+            self.condition.notify_all()
+
+    def wait(self, seqs, timeout):
+        def changed():
+            return {journal_id for journal_id, seq in seqs.items() if self.latest.get(journal_id, 0) > seq}
+
+        with self.condition:
+            return self.condition.wait_for(changed, timeout)
+
+
+class DatabasePollingNotificationBackend(BaseNotificationBackend):
+    """Notifications that work across processes by polling the journals' seqs
+
+    Every waiting request runs one cheap query per JOURNAL_NOTIFICATION_POLL_INTERVAL seconds.
+    """
+
+    def publish(self, journal_id, seq):
+        pass
+
+    def wait(self, seqs, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            current = Journal.objects.filter(pk__in=seqs.keys()).values_list('pk', 'seq')
+            changed = {journal_id for journal_id, seq in current if seq != seqs[journal_id]}
+            remaining = deadline - time.monotonic()
+            if len(changed) > 0 or remaining <= 0:
+                return changed
+            time.sleep(min(app_settings.NOTIFICATION_POLL_INTERVAL, remaining))
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend():
+    """The configured backend, shared by the whole process"""
+    path = app_settings.NOTIFICATION_BACKEND
+    with _backends_lock:
+        if path not in _backends:
+            _backends[path] = app_settings.import_from_str(path)()
+        return _backends[path]
+
+
+def publish(journal_id, seq):
+    get_backend().publish(journal_id, seq)
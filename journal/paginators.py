@@ -14,23 +14,53 @@
 
 from rest_framework import pagination
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
+from . import app_settings
+
+
+class LinkHeaderPagination(pagination.BasePagination):
+    """Keyset pagination for journal entries
+
+    The cursor is the uid of the last entry returned (the same as the `last` query param), so fetching a page is
+    just `id > cursor ORDER BY id LIMIT n`. We never count the entries nor skip over an offset.
+    """
+    limit_query_param = 'limit'
+    cursor_query_param = 'last'
+
+    def get_limit(self, request):
+        try:
+            limit = int(request.query_params[self.limit_query_param])
+        except (KeyError, ValueError):
+            return None
+
+        if limit <= 0:
+            return None
+        return min(limit, app_settings.MAX_PAGE_SIZE)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+
+        # Fetch one extra so we know if there's a next page without counting
+        page = list(queryset.order_by('id')[:self.limit + 1])
+        self.has_next = len(page) > self.limit
+        self.page = page[:self.limit]
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        return replace_query_param(url, self.cursor_query_param, self.page[-1].uid)
 
-class LinkHeaderPagination(pagination.LimitOffsetPagination):
     def get_paginated_response(self, data):
         next_url = self.get_next_link()
-        previous_url = self.get_previous_link()
-
-        if next_url is not None and previous_url is not None:
-            link = '<{next_url}>; rel="next", <{previous_url}>; rel="prev"'
-        elif next_url is not None:
-            link = '<{next_url}>; rel="next"'
-        elif previous_url is not None:
-            link = '<{previous_url}>; rel="prev"'
-        else:
-            link = ''
-
-        link = link.format(next_url=next_url, previous_url=previous_url)
-        headers = {'Link': link} if link else {}
+
+        headers = {'Link': '<{next_url}>; rel="next"'.format(next_url=next_url)} if next_url is not None else {}
 
         return Response(data, headers=headers)
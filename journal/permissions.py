@@ -13,7 +13,6 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 from rest_framework import permissions
-from journal.models import Journal, JournalMember
 
 
 class IsOwnerOrReadOnly(permissions.BasePermission):
@@ -25,7 +24,7 @@ class IsOwnerOrReadOnly(permissions.BasePermission):
         if request.method in permissions.SAFE_METHODS:
             return True
 
-        return obj.owner == request.user
+        return obj.owner_id == request.user.pk
 
 
 class IsJournalOwner(permissions.BasePermission):
@@ -34,13 +33,11 @@ class IsJournalOwner(permissions.BasePermission):
     """
 
     def has_permission(self, request, view):
-        journal_uid = view.kwargs['journal_uid']
-        try:
-            journal = view.get_journal_queryset().get(uid=journal_uid)
-            return journal.owner == request.user
-        except Journal.DoesNotExist:
+        access = view.get_journal_access()
+        if access is None:
             # If the journal does not exist, we want to 404 later, not permission denied.
             return True
+        return access.is_owner
 
 
 class IsMemberReadOnly(permissions.BasePermission):
@@ -52,14 +49,9 @@ class IsMemberReadOnly(permissions.BasePermission):
         if request.method in permissions.SAFE_METHODS:
             return True
 
-        journal_uid = view.kwargs['journal_uid']
-        try:
-            journal = view.get_journal_queryset().get(uid=journal_uid)
-            member = journal.members.get(user=request.user)
-            return not member.readOnly
-        except Journal.DoesNotExist:
+        access = view.get_journal_access()
+        if access is None:
             # If the journal does not exist, we want to 404 later, not permission denied.
             return True
-        except JournalMember.DoesNotExist:
-            # Not being a member means we are the owner.
-            return True
+        # Not being a member means we are the owner.
+        return not access.read_only
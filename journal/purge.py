@@ -0,0 +1,118 @@
+# Copyright © 2017 Tom Hacohen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+import time
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Entry, Journal, Snapshot
+
+
+def delete_entries(ids):
+    """Delete the entries by id without loading their content
+
+    The cascades still look for the journals whose last_entry they are (loading those in full), so clear that first.
+    """
+    Entry.objects.filter(pk__in=ids).only('pk').delete()
+
+
+def get_purgeable_journals(grace_period):
+    """The soft deleted journals that were deleted more than grace_period (a timedelta) ago"""
+    return Journal.objects.filter(deleted=True, modified__lt=timezone.now() - grace_period).order_by('pk')
+
+
+def purge_journal(journal, batch_size=1000, throttle=0, progress=None):
+    """Delete a soft deleted journal, its entries batch_size at a time and sleeping throttle seconds in between
+
+    Every batch is its own transaction so locks are only held briefly. If interrupted, purging again continues
+    where it stopped. Returns the number of entries deleted.
+    """
+    # Drop the references to the entries first, so deleting them doesn't need to load them for the cascades
+    with transaction.atomic():
+        if Journal.objects.filter(pk=journal.pk, deleted=True).update(last_entry=None) > 0:
+            Snapshot.objects.filter(journal_id=journal.pk).delete()
+
+    entries = Entry.objects.filter(journal_id=journal.pk, journal__deleted=True).order_by('pk')
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            ids = list(entries.values_list('pk', flat=True)[:batch_size])
+            if len(ids) > 0:
+                delete_entries(ids)
+        if len(ids) == 0:
+            break
+
+        deleted += len(ids)
+        if progress is not None:
+            progress(journal, deleted)
+        if throttle > 0:
+            time.sleep(throttle)
+
+    # Only the (few) members are left for the cascade. The owner is needed by the delete signal.
+    Journal.objects.filter(pk=journal.pk, deleted=True).only('pk', 'owner').delete()
+    return deleted
+
+
+def purge_deleted_journals(grace_period=datetime.timedelta(days=30), batch_size=1000, throttle=0, progress=None):
+    """Purge all of the journals deleted more than grace_period ago, see purge_journal
+
+    Returns the number of journals and entries deleted.
+    """
+    journals = 0
+    entries = 0
+    for journal in get_purgeable_journals(grace_period).only('pk', 'uid').iterator():
+        entries += purge_journal(journal, batch_size=batch_size, throttle=throttle, progress=progress)
+        journals += 1
+
+    return journals, entries
+
+
+def prune_snapshot_entries(snapshot, batch_size=1000, throttle=0, progress=None):
+    """Delete the entries the snapshot supersedes (keeping the covered entry itself), see purge_journal
+
+    Returns the number of entries deleted.
+    """
+    superseded = Entry.objects.filter(journal_id=snapshot.journal_id, id__lt=snapshot.entry_id).order_by('pk')
+    deleted = 0
+    while True:
+        # Neither the journal's last entry nor its (only) snapshot refer to these, so they can be deleted directly
+        with transaction.atomic():
+            ids = list(superseded.values_list('pk', flat=True)[:batch_size])
+            if len(ids) > 0:
+                delete_entries(ids)
+                Journal.objects.filter(pk=snapshot.journal_id).update(entry_count=F('entry_count') - len(ids))
+        if len(ids) == 0:
+            return deleted
+
+        deleted += len(ids)
+        if progress is not None:
+            progress(snapshot, deleted)
+        if throttle > 0:
+            time.sleep(throttle)
+
+
+def prune_superseded_entries(batch_size=1000, throttle=0, progress=None):
+    """Delete the entries superseded by the snapshots of all of the (live) journals, see prune_snapshot_entries
+
+    Returns the number of entries deleted.
+    """
+    snapshots = Snapshot.objects.filter(journal__deleted=False).only('pk', 'journal_id', 'entry_id').order_by('pk')
+    entries = 0
+    for snapshot in snapshots.iterator():
+        entries += prune_snapshot_entries(snapshot, batch_size=batch_size, throttle=throttle, progress=progress)
+
+    return entries
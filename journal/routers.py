@@ -0,0 +1,90 @@
+# Copyright © 2017 Tom Hacohen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Routing the journal app's reads to replicas (JOURNAL_READ_REPLICAS)
+
+Enable with DATABASE_ROUTERS = ['journal.routers.ReplicaRouter']. The viewsets (see BaseViewSet.initial) decide per
+request where its reads go: read requests (safe methods and the viewsets' read_only_actions) read from a random
+replica, everything else from the primary (default) database. After a user makes a successful write request,
+their reads stick to the primary for JOURNAL_READ_REPLICAS_STICKY_TIME seconds, so they see their own writes even
+when the replicas lag behind. The sticky users are tracked in the JOURNAL_READ_REPLICAS_CACHE cache so all of the
+workers know about them.
+
+Streamed entry lists are produced after the view returns, so they are read from the primary.
+"""
+
+import random
+import threading
+
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+
+from . import app_settings
+
+_local = threading.local()
+
+
+def _sticky_key(user_id):
+    return 'journal:primary:{}'.format(user_id)
+
+
+def _get_cache():
+    return caches[app_settings.READ_REPLICAS_CACHE]
+
+
+def start_request(request, read_only):
+    """Route the reads of the request handled by this thread, read_only is whether the request doesn't write"""
+    replicas = app_settings.READ_REPLICAS
+    _local.replicas = None
+    if len(replicas) == 0 or not read_only:
+        return
+
+    user = request.user
+    if user is not None and user.is_authenticated and _get_cache().get(_sticky_key(user.pk)) is not None:
+        return
+    _local.replicas = replicas
+
+
+def finish_request(request, response, read_only):
+    """Stop routing this thread's reads, and stick the user to the primary if the request wrote"""
+    _local.replicas = None
+    if len(app_settings.READ_REPLICAS) == 0 or read_only or response.status_code >= 400:
+        return
+
+    user = request.user
+    if user is not None and user.is_authenticated:
+        _get_cache().set(_sticky_key(user.pk), True, app_settings.READ_REPLICAS_STICKY_TIME)
+
+
+class ReplicaRouter:
+    app_label = 'journal'
+
+    def db_for_read(self, model, **hints):
+        replicas = getattr(_local, 'replicas', None)
+        if model._meta.app_label != self.app_label or replicas is None:
+            return None
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        # Explicitly, as otherwise objects read from a replica would be saved back to it
+        if model._meta.app_label != self.app_label:
+            return None
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas have the same data as the primary
+        databases = {DEFAULT_DB_ALIAS}.union(app_settings.READ_REPLICAS)
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
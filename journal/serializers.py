@@ -13,24 +13,37 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 import base64
+import re
 
-from django.db.models.expressions import RawSQL
 from django.contrib.auth import get_user_model
+from django.db.models import F
 from rest_framework import serializers
-from . import models
+from . import app_settings, models
+from .timing import TimedSerializerMixin
 
 User = get_user_model()
 
 
 class BinaryBase64Field(serializers.Field):
     def to_representation(self, value):
+        if self.binary_format:
+            return bytes(value)
         return base64.b64encode(value).decode('ascii')
 
     def to_internal_value(self, data):
+        # Binary formats (e.g. MessagePack) pass the raw bytes
+        if isinstance(data, bytes):
+            return data
         return base64.b64decode(data)
 
+    @property
+    def binary_format(self):
+        request = self.context.get('request', None)
+        renderer = getattr(request, 'accepted_renderer', None)
+        return getattr(renderer, 'render_style', None) == 'binary'
+
 
-class JournalSerializer(serializers.ModelSerializer):
+class JournalSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     content = BinaryBase64Field()
     owner = serializers.SlugRelatedField(
         slug_field=User.USERNAME_FIELD,
@@ -45,17 +58,27 @@ class JournalSerializer(serializers.ModelSerializer):
         fields = ('version', 'uid', 'content', 'owner', 'key', 'readOnly', 'lastUid')
 
     def get_key_from_context(self, obj):
-        request = self.context.get('request', None)
-        if request is not None:
-            try:
-                member = obj.members.get(user=request.user)
-                serialized_member = JournalMemberSerializer(member)
-                return serialized_member.data['key']
-            except models.JournalMember.DoesNotExist:
-                pass
-        return None
+        key = None
+        # Annotated by JournalViewSet.get_list_queryset
+        if hasattr(obj, 'member_key'):
+            key = obj.member_key
+        else:
+            request = self.context.get('request', None)
+            if request is not None:
+                try:
+                    key = obj.members.get(user=request.user).key
+                except models.JournalMember.DoesNotExist:
+                    pass
+
+        if key is None:
+            return None
+        # Encoded the same way as the content
+        return self.fields['content'].to_representation(key)
 
     def get_read_only_from_context(self, obj):
+        if hasattr(obj, 'member_read_only'):
+            return bool(obj.member_read_only)
+
         request = self.context.get('request', None)
         if request is not None:
             try:
@@ -66,28 +89,100 @@ class JournalSerializer(serializers.ModelSerializer):
         return False
 
     def get_last_uid(self, obj):
-        last = models.Entry.objects.filter(
-                id=RawSQL('SELECT MAX(journal_entry.id) FROM journal_entry WHERE journal_entry.journal_id = %s GROUP BY journal_entry.journal_id', (obj.id, ))
-            ).first()
-        if last:
-            return last.uid
-        return None
+        if hasattr(obj, 'last_uid'):
+            return obj.last_uid
+
+        if obj.last_entry_id is None:
+            return None
+        return models.Entry.objects.filter(pk=obj.last_entry_id).values_list('uid', flat=True).first()
 
 
 class JournalUpdateSerializer(JournalSerializer):
     class Meta(JournalSerializer.Meta):
         fields = ('content', )
 
+    def update(self, instance, validated_data):
+        instance.content = validated_data['content']
+        # Only the changed fields, so we don't overwrite the counters if there was an append since we read them
+        instance.save(update_fields=['content', 'modified'])
+        return instance
+
+
+class EntryListSerializer(serializers.ListSerializer):
+    """Validates and inserts lists of entries in bulk"""
+    uid_regex = re.compile(r'[a-fA-F0-9]{64}')
+
+    def to_internal_value(self, data):
+        # Fast path: validate the whole batch in one pass. If anything is off, fall back to the per-entry
+        # validation which also generates the proper error messages.
+        if isinstance(data, list) and (self.allow_empty or len(data) > 0):
+            content_field = self.child.fields['content']
+            ret = []
+            try:
+                for item in data:
+                    uid = item['uid']
+                    content = item['content']
+                    if not isinstance(uid, str) or self.uid_regex.fullmatch(uid) is None or content is None:
+                        break
+                    ret.append({'uid': uid, 'content': content_field.to_internal_value(content)})
+                else:
+                    return ret
+            except (TypeError, KeyError, ValueError):
+                pass
+
+        return super().to_internal_value(data)
+
+    def create(self, validated_data):
+        entries = [models.Entry(**item) for item in validated_data]
+        if len(entries) == 0:
+            return entries
+
+        # bulk_create doesn't call Entry.save, so assign the seqs and update the journal ourselves.
+        # The caller should hold the journal's lock so journal.seq is up to date (see EntryViewSet.create).
+        journal = entries[0].journal
+        for seq, entry in enumerate(entries, start=journal.seq + 1):
+            entry.seq = seq
+        models.Entry.objects.bulk_create(entries, batch_size=app_settings.BULK_CREATE_BATCH_SIZE)
+        last = entries[-1]
+        if last.pk is None:
+            # Not all databases return the ids from bulk inserts
+            last.pk = models.Entry.objects.filter(journal=journal, uid=last.uid).values_list('pk', flat=True).get()
+        models.Journal.objects.filter(pk=journal.pk).update(last_entry=last.pk, seq=last.seq,
+                                                            entry_count=F('entry_count') + len(entries))
+        journal.seq = last.seq
 
-class EntrySerializer(serializers.ModelSerializer):
+        return entries
+
+
+class EntrySerializer(TimedSerializerMixin, serializers.ModelSerializer):
     content = BinaryBase64Field()
 
     class Meta:
         model = models.Entry
         fields = ('uid', 'content')
+        list_serializer_class = EntryListSerializer
+
+
+class JournalEntryRelatedField(serializers.SlugRelatedField):
+    """An entry of the journal in the context, by uid"""
+
+    def __init__(self, **kwargs):
+        super().__init__(slug_field='uid', **kwargs)
+
+    def get_queryset(self):
+        return models.Entry.objects.metadata().filter(journal_id=self.context['journal_id'])
+
+
+class SnapshotSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    entryUid = JournalEntryRelatedField(source='entry')
+    content = BinaryBase64Field()
+
+    class Meta:
+        model = models.Snapshot
+        fields = ('entryUid', 'content')
 
 
-class UserInfoSerializer(serializers.ModelSerializer):
+class UserInfoSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     content = BinaryBase64Field()
     pubkey = BinaryBase64Field()
 
@@ -101,7 +196,7 @@ class UserInfoPublicSerializer(UserInfoSerializer):
         fields = ('version', 'pubkey')
 
 
-class JournalMemberSerializer(serializers.ModelSerializer):
+class JournalMemberSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     user = serializers.SlugRelatedField(
         slug_field=User.USERNAME_FIELD,
         queryset=User.objects
@@ -0,0 +1,80 @@
+# Copyright © 2017 Tom Hacohen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import time
+
+from django.core.cache import caches
+from rest_framework.throttling import BaseThrottle
+
+from . import app_settings
+
+
+class CostThrottle(BaseThrottle):
+    """A per user token bucket, charged by the estimated cost of each request
+
+    The cost is what the view's get_throttle_cost(request) returns (e.g. the number of entries the request returns),
+    or 1 for views without one. The bucket holds up to JOURNAL_THROTTLE_BURST tokens and is refilled at
+    JOURNAL_THROTTLE_RATE tokens per second. A request costing more than the burst is let through when the bucket is
+    full, leaving it in debt.
+
+    The buckets are kept in the JOURNAL_THROTTLE_CACHE cache so they're shared by all of the workers. Updating them
+    isn't atomic, so concurrent requests of the same user may occasionally both be let through.
+
+    Enable by adding it to REST_FRAMEWORK's DEFAULT_THROTTLE_CLASSES.
+    """
+    timer = time.time
+
+    def __init__(self):
+        self.retry_after = None
+
+    def get_cache_key(self, request, view):
+        if request.user is not None and request.user.is_authenticated:
+            ident = request.user.pk
+        else:
+            ident = self.get_ident(request)
+        return 'journal:throttle:{}'.format(ident)
+
+    def get_cost(self, request, view):
+        get_throttle_cost = getattr(view, 'get_throttle_cost', None)
+        if get_throttle_cost is None:
+            return 1
+        return max(1, get_throttle_cost(request))
+
+    def allow_request(self, request, view):
+        rate = app_settings.THROTTLE_RATE
+        burst = app_settings.THROTTLE_BURST
+        cache = caches[app_settings.THROTTLE_CACHE]
+        key = self.get_cache_key(request, view)
+        now = self.timer()
+
+        tokens, updated = cache.get(key, (burst, now))
+        tokens = min(burst, tokens + max(0, now - updated) * rate)
+
+        cost = self.get_cost(request, view)
+        required = min(cost, burst)
+        if tokens < required:
+            self.retry_after = (required - tokens) / rate
+            cache.set(key, (tokens, now), self.get_timeout(tokens, rate, burst))
+            return False
+
+        tokens -= cost
+        cache.set(key, (tokens, now), self.get_timeout(tokens, rate, burst))
+        return True
+
+    def get_timeout(self, tokens, rate, burst):
+        # Once refilled the bucket is the same as a missing one
+        return max(1, int((burst - tokens) / rate) + 1)
+
+    def wait(self):
+        return self.retry_after
@@ -0,0 +1,112 @@
+# Copyright © 2017 Tom Hacohen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Per request timings of the database, serialization and rendering (see JOURNAL_SERVER_TIMING)
+
+The timings are sent in the Server-Timing header and logged (as JSON) to the journal.timing logger.
+"""
+
+import collections
+import contextlib
+import json
+import logging
+import threading
+import time
+
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+def current():
+    """The timing of the request being handled by this thread, None if not timing"""
+    return getattr(_local, 'timing', None)
+
+
+class RequestTiming:
+    def __init__(self):
+        self.queries = 0
+        self.durations = collections.OrderedDict((name, 0.0) for name in ('db', 'serialize', 'render', 'total'))
+        self._tracking = set()
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.durations['db'] += time.perf_counter() - start
+
+    @contextlib.contextmanager
+    def track(self, name):
+        """Add the time spent in the block to name, nested blocks of the same name are only counted once"""
+        if name in self._tracking:
+            yield
+            return
+
+        self._tracking.add(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations[name] += time.perf_counter() - start
+            self._tracking.discard(name)
+
+    @contextlib.contextmanager
+    def activate(self):
+        """Time the block as the request handled by this thread, including the queries of all of the databases"""
+        _local.timing = self
+        try:
+            with contextlib.ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(self.execute_wrapper))
+                with self.track('total'):
+                    yield self
+        finally:
+            _local.timing = None
+
+    def get_header(self):
+        metrics = []
+        for name, duration in self.durations.items():
+            metric = '{};dur={:.2f}'.format(name, duration * 1000)
+            if name == 'db':
+                metric += ';desc="{} queries"'.format(self.queries)
+            metrics.append(metric)
+        return ', '.join(metrics)
+
+    def log(self, request, response, view):
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': type(view).__name__,
+            'action': getattr(view, 'action', None),
+            'status': response.status_code,
+            'queries': self.queries,
+        }
+        for name, duration in self.durations.items():
+            record[name + '_ms'] = round(duration * 1000, 2)
+        logger.info(json.dumps(record, sort_keys=True), extra={'server_timing': record})
+
+
+class TimedSerializerMixin:
+    """Serializer mixin that counts the time spent representing objects (and the queries that needs) as serialize"""
+
+    def to_representation(self, instance):
+        timing = current()
+        if timing is None:
+            return super().to_representation(instance)
+        with timing.track('serialize'):
+            return super().to_representation(instance)
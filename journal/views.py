@@ -12,27 +12,38 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
+import time
+
 from django.conf import settings
 from django.contrib.auth import login, get_user_model
 from django.db import IntegrityError, transaction
-from django.db.models import Q
+from django.db.models import F, OuterRef, Subquery
 from django.core.exceptions import ObjectDoesNotExist
-from django.http import HttpResponseBadRequest, HttpResponse, Http404
+from django.http import HttpResponseBadRequest, HttpResponse, Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 
 from rest_framework import status
 from rest_framework import viewsets
+from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.permissions import SAFE_METHODS
 from rest_framework.renderers import JSONRenderer, BrowsableAPIRenderer
+from rest_framework.settings import api_settings
+from rest_framework.utils import encoders
 
-from . import app_settings, permissions, paginators
-from .models import Entry, Journal, UserInfo, JournalMember
+from . import (
+        access, app_settings, metrics, notifications, permissions, paginators, parsers, renderers, routers, timing
+    )
+from .models import Entry, Journal, UserInfo, JournalMember, Snapshot
 from .serializers import (
         EntrySerializer, JournalSerializer, JournalUpdateSerializer,
         UserInfoSerializer, UserInfoPublicSerializer,
-        JournalMemberSerializer
+        JournalMemberSerializer, SnapshotSerializer
     )
 
 
@@ -42,7 +53,56 @@ User = get_user_model()
 class BaseViewSet(viewsets.ModelViewSet):
     authentication_classes = tuple(app_settings.API_AUTHENTICATORS)
     permission_classes = tuple(app_settings.API_PERMISSIONS)
-    renderer_classes = [JSONRenderer] + ([BrowsableAPIRenderer] if settings.DEBUG else [])
+    renderer_classes = [JSONRenderer] + \
+        ([renderers.MessagePackRenderer] if renderers.msgpack is not None else []) + \
+        ([BrowsableAPIRenderer] if settings.DEBUG else [])
+    parser_classes = list(api_settings.DEFAULT_PARSER_CLASSES) + \
+        ([parsers.MessagePackParser] if parsers.msgpack is not None else [])
+    # Actions that only read despite their (unsafe) method
+    read_only_actions = ()
+
+    def dispatch(self, request, *args, **kwargs):
+        server_timing, collect_metrics = app_settings.SERVER_TIMING, app_settings.METRICS
+        if not server_timing and not collect_metrics:
+            return super().dispatch(request, *args, **kwargs)
+
+        start = time.perf_counter()
+        if server_timing:
+            response = self.timed_dispatch(request, *args, **kwargs)
+        else:
+            response = super().dispatch(request, *args, **kwargs)
+            # Rendered here (rather than by the handler) so we know the size
+            if callable(getattr(response, 'render', None)):
+                response.render()
+
+        if collect_metrics:
+            metrics.observe_response(self, response, time.perf_counter() - start)
+        return response
+
+    def is_read_only(self, request):
+        """Whether the request only reads (e.g. its reads can be served by a replica, see routers)"""
+        return request.method in SAFE_METHODS or self.action in self.read_only_actions
+
+    def initial(self, request, *args, **kwargs):
+        routers.start_request(request, self.is_read_only(request))
+        super().initial(request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        routers.finish_request(request, response, self.is_read_only(request))
+        return super().finalize_response(request, response, *args, **kwargs)
+
+    def timed_dispatch(self, request, *args, **kwargs):
+        with timing.RequestTiming().activate() as request_timing:
+            response = super().dispatch(request, *args, **kwargs)
+            # Rendered here (rather than by the handler) so it's timed. Streamed responses are produced later,
+            # so the queries and serialization of their content aren't included.
+            if callable(getattr(response, 'render', None)):
+                with request_timing.track('render'):
+                    response.render()
+
+        response['Server-Timing'] = request_timing.get_header()
+        request_timing.log(request, response, self)
+        return response
 
     def get_serializer_class(self):
         serializer_class = self.serializer_class
@@ -54,8 +114,69 @@ class BaseViewSet(viewsets.ModelViewSet):
 
     def get_journal_queryset(self, queryset=Journal.objects):
         user = self.request.user
-        return queryset.filter(Q(owner=user) | Q(members__user=user),
-                               deleted=False).distinct()
+        if access.is_cache_enabled():
+            journal_ids = [journal_id for journal_id, _, _, _ in access.get_access_map(user).values()]
+            return queryset.filter(pk__in=journal_ids, deleted=False)
+
+        return access.filter_accessible(queryset, user)
+
+    def get_journal_access_queryset(self):
+        return access.annotate_membership(self.get_journal_queryset(Journal.objects.metadata()), self.request.user)
+
+    def get_journal_access(self):
+        """The user's access to the journal in the url (None if no access), only resolved once per request"""
+        if not hasattr(self, '_journal_access'):
+            journal_uid = self.kwargs['journal_uid']
+            if access.is_cache_enabled():
+                self._journal_access = self.get_cached_journal_access(journal_uid)
+            else:
+                try:
+                    journal = self.get_journal_access_queryset().get(uid=journal_uid)
+                    self._journal_access = access.JournalAccess(
+                        journal_id=journal.pk,
+                        is_owner=journal.owner_id == self.request.user.pk,
+                        is_member=journal.member_read_only is not None,
+                        read_only=bool(journal.member_read_only),
+                        get_journal=lambda: journal,
+                    )
+                except Journal.DoesNotExist:
+                    self._journal_access = None
+
+        return self._journal_access
+
+    def get_cached_journal_access(self, journal_uid):
+        cached = access.get_access_map(self.request.user).get(journal_uid, None)
+        if cached is None:
+            return None
+
+        journal_id, is_owner, is_member, read_only = cached
+
+        def get_journal():
+            try:
+                return self.get_journal_access_queryset().get(pk=journal_id)
+            except Journal.DoesNotExist:
+                raise Http404("Journal does not exist")
+
+        return access.JournalAccess(journal_id=journal_id, is_owner=is_owner, is_member=is_member,
+                                    read_only=read_only, get_journal=get_journal)
+
+    def get_journal_access_or_404(self):
+        journal_access = self.get_journal_access()
+        if journal_access is None:
+            raise Http404("Journal does not exist")
+        return journal_access
+
+    def get_etag(self, validators):
+        # The representation differs between formats, so the etag should too
+        validators = (validators, self.request.accepted_renderer.format)
+        return quote_etag(hashlib.sha256(repr(validators).encode('utf-8')).hexdigest())
+
+    def get_not_modified_response(self, etag):
+        """Returns a 304 response if the client's copy (If-None-Match) is still valid, None otherwise"""
+        response = get_conditional_response(self.request, etag=etag)
+        if response is not None:
+            response['ETag'] = etag
+        return response
 
 
 class JournalViewSet(BaseViewSet):
@@ -65,15 +186,42 @@ class JournalViewSet(BaseViewSet):
     serializer_class = JournalSerializer
     serializer_update_class = JournalUpdateSerializer
     lookup_field = 'uid'
+    read_only_actions = ('changes', 'sync')
 
     def get_queryset(self):
         queryset = type(self).queryset
+        if self.action in ('update', 'partial_update', 'destroy'):
+            # The content is either replaced or not needed at all
+            queryset = queryset.metadata()
         return self.get_journal_queryset(queryset)
 
+    def get_list_queryset(self):
+        """The journal queryset annotated with everything JournalSerializer needs
+
+        This lets us list (or retrieve) journals with a fixed number of queries instead of a few per journal.
+        """
+        user = self.request.user
+        memberships = JournalMember.objects.filter(journal=OuterRef('pk'), user=user)
+
+        return self.get_queryset().select_related('owner').annotate(
+            member_key=Subquery(memberships.values('key')[:1]),
+            member_read_only=Subquery(memberships.values('readOnly')[:1]),
+            member_id=Subquery(memberships.values('pk')[:1]),
+            last_uid=F('last_entry__uid'),
+        )
+
+    def retrieve(self, request, uid=None):
+        journal = get_object_or_404(self.get_list_queryset(), uid=uid)
+        self.check_object_permissions(request, journal)
+
+        serializer = self.serializer_class(journal, context={'request': request})
+        return Response(serializer.data)
+
     def destroy(self, request, uid=None):
         journal = self.get_object()
         journal.deleted = True
-        journal.save()
+        # Only the changed fields, so we don't overwrite the counters if there was an append since we read them
+        journal.save(update_fields=['deleted', 'modified'])
 
         return Response(status=status.HTTP_204_NO_CONTENT)
 
@@ -91,11 +239,170 @@ class JournalViewSet(BaseViewSet):
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    def get_list_etag(self, journals=None):
+        """The list's etag, from the already fetched list queryset or (cheaply) from the db
+
+        Content changes update modified, appending updates last_entry and re-sharing creates a new member.
+        """
+        if journals is None:
+            user = self.request.user
+            memberships = JournalMember.objects.filter(journal=OuterRef('pk'), user=user)
+            journals = self.get_queryset().annotate(member_id=Subquery(memberships.values('pk')[:1])) \
+                .only('pk', 'modified', 'last_entry_id')
+
+        validators = sorted((journal.pk, journal.modified, journal.last_entry_id, journal.member_id)
+                            for journal in journals)
+        return self.get_etag(validators)
+
     def list(self, request):
-        queryset = self.get_queryset()
+        # Conditional requests are usually idle polls, so check the validators before doing the real work
+        if 'HTTP_IF_NONE_MATCH' in request.META:
+            response = self.get_not_modified_response(self.get_list_etag())
+            if response is not None:
+                return response
+
+        queryset = list(self.get_list_queryset())
 
         serializer = self.serializer_class(queryset, context={'request': request}, many=True)
-        return Response(serializer.data)
+        response = Response(serializer.data)
+        response['ETag'] = self.get_list_etag(queryset)
+        return response
+
+    @action(detail=False, methods=['post'])
+    def changes(self, request):
+        """Long poll for new entries
+
+        Takes {journal_uid: last_uid} and returns {journal_uid: last_uid} for the journals whose last entry differs,
+        waiting (up to ?timeout= seconds) for an append if there are none yet. Inaccessible journals are ignored.
+        """
+        last_uids = self.get_last_uids()
+        if last_uids is None:
+            content = {'code': 'invalid_format', 'detail': 'Expected a map of journal uid to last entry uid'}
+            return Response(content, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            timeout = min(float(request.query_params['timeout']), app_settings.NOTIFICATION_TIMEOUT)
+        except (KeyError, ValueError):
+            timeout = app_settings.NOTIFICATION_TIMEOUT
+
+        queryset = self.get_queryset().filter(uid__in=last_uids.keys()) \
+            .values_list('pk', 'uid', 'seq', 'last_entry__uid')
+
+        def get_changes(journals):
+            return {uid: last for _, uid, _, last in journals if last != last_uids[uid]}
+
+        journals = list(queryset)
+        changes = get_changes(journals)
+        if len(changes) == 0 and len(journals) > 0 and timeout > 0:
+            seqs = {pk: seq for pk, _, seq, _ in journals}
+            if notifications.get_backend().wait(seqs, timeout):
+                changes = get_changes(queryset.all())
+
+        return Response(changes)
+
+    @action(detail=False, methods=['post'])
+    def sync(self, request):
+        """Fetch the new entries of many journals at once
+
+        Takes {journal_uid: last_uid} (null to fetch from the start) and returns {journal_uid: {entries, next}} with
+        up to ?limit= entries per journal. If there are more, next is the uid to pass as the journal's last_uid to
+        continue. Inaccessible journals are ignored.
+
+        The map can have up to JOURNAL_SYNC_MAX_JOURNALS journals. The response has up to JOURNAL_SYNC_MAX_ENTRIES
+        entries, taken from the journals in the order of the map, though every journal gets at least one (so it has
+        a next to continue from).
+        """
+        last_uids = self.get_last_uids()
+        if last_uids is None:
+            content = {'code': 'invalid_format', 'detail': 'Expected a map of journal uid to last entry uid'}
+            return Response(content, status=status.HTTP_400_BAD_REQUEST)
+        if len(last_uids) > app_settings.SYNC_MAX_JOURNALS:
+            content = {'code': 'too_many_journals',
+                       'detail': 'At most {} journals can be synced at once'.format(app_settings.SYNC_MAX_JOURNALS)}
+            return Response(content, status=status.HTTP_400_BAD_REQUEST)
+
+        limit = paginators.LinkHeaderPagination().get_limit(request) or app_settings.MAX_PAGE_SIZE
+
+        # One query for the access checks of all of the journals and one for resolving all of the last entries
+        journals = dict(self.get_queryset().filter(uid__in=last_uids.keys()).values_list('uid', 'pk'))
+        lasts = {uid: last for uid, last in last_uids.items() if uid in journals and last is not None}
+        last_ids = {}
+        if len(lasts) > 0:
+            last_entries = Entry.objects.filter(journal_id__in=[journals[uid] for uid in lasts],
+                                                uid__in=lasts.values())
+            for journal_id, uid, pk in last_entries.values_list('journal_id', 'uid', 'pk'):
+                last_ids[journal_id, uid] = pk
+
+        context = self.get_serializer_context()
+        remaining = app_settings.SYNC_MAX_ENTRIES
+        ret = {}
+        for uid in last_uids:
+            if uid not in journals:
+                continue
+            journal_id = journals[uid]
+            queryset = Entry.objects.filter(journal_id=journal_id)
+            last = last_uids[uid]
+            if last is not None:
+                if (journal_id, last) not in last_ids:
+                    ret[uid] = {'code': 'not_found', 'detail': 'Entry does not exist'}
+                    continue
+                queryset = queryset.filter(id__gt=last_ids[journal_id, last])
+
+            # Fetch one extra so we know if there's more without counting
+            journal_limit = max(1, min(limit, remaining))
+            page = list(queryset.order_by('id')[:journal_limit + 1])
+            has_next = len(page) > journal_limit
+            page = page[:journal_limit]
+            remaining -= len(page)
+            ret[uid] = {
+                'entries': EntrySerializer(page, many=True, context=context).data,
+                'next': page[-1].uid if has_next else None,
+            }
+
+        return Response(ret)
+
+    def get_last_uids(self):
+        """The {journal_uid: last_uid} map from the request body, or None if malformed"""
+        last_uids = self.request.data
+        if not isinstance(last_uids, dict) or \
+                not all(isinstance(last, str) or last is None for last in last_uids.values()):
+            return None
+        return last_uids
+
+    def get_throttle_cost(self, request):
+        """The number of entries a sync returns (estimated from the seqs), see throttling.CostThrottle"""
+        if self.action != 'sync':
+            return 1
+
+        last_uids = self.get_last_uids()
+        if last_uids is None or len(last_uids) > app_settings.SYNC_MAX_JOURNALS:
+            # Rejected (see sync)
+            return 1
+
+        limit = paginators.LinkHeaderPagination().get_limit(request) or app_settings.MAX_PAGE_SIZE
+        journals = list(self.get_queryset().filter(uid__in=last_uids.keys())
+                        .values_list('pk', 'uid', 'seq', 'entry_count'))
+        lasts = [last_uids[uid] for _, uid, _, _ in journals if last_uids[uid] is not None]
+        last_seqs = {}
+        if len(lasts) > 0:
+            last_entries = Entry.objects.filter(journal_id__in=[pk for pk, _, _, _ in journals], uid__in=lasts)
+            for journal_id, uid, seq in last_entries.values_list('journal_id', 'uid', 'seq'):
+                last_seqs[journal_id, uid] = seq
+
+        cost = 0
+        for pk, uid, seq, entry_count in journals:
+            last = last_uids[uid]
+            if last is None:
+                count = entry_count
+            elif (pk, last) in last_seqs:
+                count = seq - last_seqs[pk, last]
+            else:
+                # Answered with not_found
+                continue
+            cost += min(count, limit)
+
+        # Bounded like the response is
+        return min(cost, max(app_settings.SYNC_MAX_ENTRIES, len(journals)))
 
 
 class MembersViewSet(BaseViewSet):
@@ -108,16 +415,18 @@ class MembersViewSet(BaseViewSet):
     lookup_url_kwarg = 'username'
 
     def get_queryset(self):
-        journal_uid = self.kwargs['journal_uid']
-        return type(self).queryset.filter(journal__uid=journal_uid)
+        journal_access = self.get_journal_access()
+        if journal_access is None:
+            return type(self).queryset.none()
+        return type(self).queryset.filter(journal_id=journal_access.journal_id)
 
     def create(self, request, journal_uid=None):
         serializer = self.serializer_class(data=request.data)
-        journal = get_object_or_404(self.get_journal_queryset(Journal.objects), uid=journal_uid)
+        journal_id = self.get_journal_access_or_404().journal_id
         if serializer.is_valid():
             try:
                 with transaction.atomic():
-                    serializer.save(journal=journal)
+                    serializer.save(journal_id=journal_id)
             except IntegrityError:
                 content = {'code': 'already_exists', 'detail': 'Member already exists'}
                 return Response(content, status=status.HTTP_400_BAD_REQUEST)
@@ -126,10 +435,11 @@ class MembersViewSet(BaseViewSet):
         return Response({}, status=status.HTTP_400_BAD_REQUEST)
 
     def list(self, request, journal_uid=None):
-        journal = get_object_or_404(self.get_journal_queryset(Journal.objects), uid=journal_uid)
-        members = JournalMember.objects.filter(journal=journal).exclude(user=self.request.user)
+        journal_id = self.get_journal_access_or_404().journal_id
+        members = JournalMember.objects.filter(journal_id=journal_id).exclude(user=self.request.user) \
+            .select_related('user')
 
-        serializer = JournalMemberSerializer(members, many=True)
+        serializer = self.get_serializer(members, many=True)
         return Response(serializer.data)
 
     def update(self, request, partial, username=None, journal_uid=None):
@@ -144,44 +454,192 @@ class EntryViewSet(BaseViewSet):
     pagination_class = paginators.LinkHeaderPagination
     lookup_field = 'uid'
 
-    def get_queryset(self, use_last=True):
+    def get_queryset(self):
+        # The access check and resolving the last entry are done as subqueries so we only have one round trip.
+        # This means an inaccessible journal just results in an empty queryset, see get_journal_or_404.
         journal_uid = self.kwargs['journal_uid']
-        try:
-            journal = self.get_journal_queryset(Journal.objects).get(uid=journal_uid)
-        except Journal.DoesNotExist:
-            raise Http404("Journal does not exist")
-        queryset = type(self).queryset.filter(journal__pk=journal.pk)
+        journals = self.get_journal_queryset(Journal.objects).filter(uid=journal_uid)
+        # Compared as single values (rather than IN or correlated subqueries) so the (journal, id) index is used for
+        # both the range and the ordering
+        journal_id = Subquery(journals.values('pk')[:1])
+        queryset = type(self).queryset.filter(journal=journal_id)
 
         last = self.request.query_params.get('last', None)
-        if use_last and last is not None:
-            last_entry = get_object_or_404(queryset, uid=last)
-            queryset = queryset.filter(id__gt=last_entry.id)
+        if last is not None:
+            last_entry = Entry.objects.filter(journal=journal_id, uid=last)
+            queryset = queryset.filter(id__gt=Subquery(last_entry.values('id')[:1]))
 
         return queryset
 
-    def create(self, request, journal_uid=None):
-        queryset = self.get_queryset(use_last=False)
+    def get_journal_access_queryset(self):
+        queryset = super().get_journal_access_queryset()
 
-        last = request.query_params.get('last', None)
-        last_entry = None
+        # Resolve the last entry (annotated as last_id) along with the journal
+        last = self.request.query_params.get('last', None)
         if last is not None:
-            last_entry = get_object_or_404(queryset, uid=last)
+            last_entry = Entry.objects.filter(journal=OuterRef('pk'), uid=last)
+            queryset = queryset.annotate(last_id=Subquery(last_entry.values('id')[:1]))
+            if self.action == 'list':
+                # For get_throttle_cost
+                queryset = queryset.annotate(last_seq=Subquery(last_entry.values('seq')[:1]))
+
+        return queryset
+
+    def get_throttle_cost(self, request):
+        """The number of entries the request returns (estimated from the seqs), see throttling.CostThrottle"""
+        if self.action != 'list':
+            return 1
+
+        journal_access = self.get_journal_access()
+        if journal_access is None:
+            return 1
+
+        journal = journal_access.journal
+        if 'HTTP_IF_NONE_MATCH' in request.META and \
+                self.get_not_modified_response(self.get_list_etag(journal.last_entry_id, journal.entry_count)):
+            # Answered with a 304 (see list)
+            return 1
+
+        if request.query_params.get('last', None) is None:
+            count = journal.entry_count
+        elif journal.last_seq is not None:
+            count = journal.seq - journal.last_seq
+        else:
+            return 1
+
+        limit = paginators.LinkHeaderPagination().get_limit(request)
+        return count if limit is None else min(count, limit)
+
+    def get_journal_or_404(self):
+        """Get the journal, with the id of the `last` entry (if passed) annotated as last_id"""
+        journal = self.get_journal_access_or_404().journal
+
+        if self.request.query_params.get('last', None) is not None and journal.last_id is None:
+            raise Http404("Entry does not exist")
 
-        journal_object = self.get_journal_queryset(Journal.objects).get(uid=journal_uid)
+        return journal
+
+    def get_list_etag(self, last_entry_id, entry_count):
+        # Entries are only appended, so the journal's last entry (and the query) identify the response
+        validators = (last_entry_id, entry_count, self.request.META.get('QUERY_STRING', ''))
+        return self.get_etag(validators)
+
+    def list(self, request, journal_uid=None):
+        # Conditional requests are usually idle polls, so check the validators before doing the real work
+        if 'HTTP_IF_NONE_MATCH' in request.META:
+            journal = self.get_journal_or_404()
+            response = self.get_not_modified_response(self.get_list_etag(journal.last_entry_id, journal.entry_count))
+            if response is not None:
+                return response
+
+        # We get the etag validators along with the entries to save a query
+        queryset = self.filter_queryset(self.get_queryset()).annotate(
+            journal_last_entry_id=F('journal__last_entry_id'),
+            journal_entry_count=F('journal__entry_count'),
+        )
+
+        page = self.paginate_queryset(queryset)
+        # Async views can't always stream (see async_views.as_async_view)
+        stream = page is None and app_settings.STREAM_ENTRIES and getattr(request, 'streaming_supported', True) and \
+            isinstance(request.accepted_renderer, JSONRenderer)
+        if stream:
+            chunk = list(queryset.order_by('id')[:app_settings.STREAM_CHUNK_SIZE])
+            first = chunk[0] if len(chunk) > 0 else None
+            entries = self.iterate_in_chunks(queryset, chunk)
+        else:
+            entries = page if page is not None else list(queryset)
+            first = entries[0] if len(entries) > 0 else None
+
+        if first is None:
+            # Empty is also what we get for an inaccessible journal or a non-existent last, so check for those.
+            journal = self.get_journal_or_404()
+            etag = self.get_list_etag(journal.last_entry_id, journal.entry_count)
+        else:
+            etag = self.get_list_etag(first.journal_last_entry_id, first.journal_entry_count)
+
+        if stream:
+            response = self.stream_entries(entries)
+        else:
+            serializer = self.get_serializer(entries, many=True)
+            if page is not None:
+                response = self.get_paginated_response(serializer.data)
+            else:
+                response = Response(serializer.data)
+
+        response['ETag'] = etag
+        return response
+
+    def iterate_in_chunks(self, queryset, chunk):
+        """Iterate over the queryset (starting with its first chunk) fetching STREAM_CHUNK_SIZE entries at a time
+
+        Every chunk is its own keyset query rather than a long lived cursor, so the chunks can also be fetched by
+        different threads (see async_views).
+        """
+        chunk_size = app_settings.STREAM_CHUNK_SIZE
+        while True:
+            yield from chunk
+            if len(chunk) < chunk_size:
+                return
+            chunk = list(queryset.filter(id__gt=chunk[-1].id).order_by('id')[:chunk_size])
+
+    def stream_entries(self, entries):
+        """Stream the entries as a JSON array, only holding one chunk of them in memory at a time"""
+        chunk_size = app_settings.STREAM_CHUNK_SIZE
+        serializer = self.get_serializer()
+        encoder = encoders.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+        def render():
+            prefix = '['
+            chunk = []
+            for entry in entries:
+                chunk.append(encoder.encode(serializer.to_representation(entry)))
+                if len(chunk) == chunk_size:
+                    yield (prefix + ','.join(chunk)).encode('utf-8')
+                    prefix = ','
+                    chunk = []
+
+            if len(chunk) > 0:
+                yield (prefix + ','.join(chunk) + ']').encode('utf-8')
+            else:
+                yield b'[]' if prefix == '[' else b']'
+
+        return StreamingHttpResponse(render(), content_type='application/json')
+
+    def create(self, request, journal_uid=None):
+        journal_object = self.get_journal_or_404()
+        last_entry_id = getattr(journal_object, 'last_id', None)
 
         many = isinstance(request.data, list)
         serializer = self.serializer_class(data=request.data, many=many)
         if serializer.is_valid():
             try:
+                if last_entry_id != journal_object.last_entry_id:
+                    if app_settings.METRICS:
+                        metrics.APPEND_CONFLICTS.inc(reason='stale')
+                    return Response({}, status=status.HTTP_409_CONFLICT)
+
                 with transaction.atomic():
-                    # We use select_for_update in the next line as to get a lock on the insert.
-                    # After the lock is freed we get the up to date last
-                    queryset.select_for_update().last()
-                    last_in_db = queryset.last()
-                    if last_entry != last_in_db:
+                    # Compare-and-swap the journal's seq to claim the seqs of the new entries. This also locks the
+                    # journal row (on every backend, unlike select_for_update) so appends are serialized, even to
+                    # an empty journal. Losing the race means someone appended after the last entry we were given.
+                    count = len(serializer.validated_data) if many else 1
+                    start = time.perf_counter()
+                    claimed = Journal.objects.filter(pk=journal_object.pk, seq=journal_object.seq) \
+                        .update(seq=F('seq') + count)
+                    if app_settings.METRICS:
+                        metrics.APPEND_LOCK_WAIT.observe(time.perf_counter() - start)
+                    if claimed == 0:
+                        if app_settings.METRICS:
+                            metrics.APPEND_CONFLICTS.inc(reason='race')
                         return Response({}, status=status.HTTP_409_CONFLICT)
 
-                    serializer.save(journal=journal_object)
+                    journal_id, seq = journal_object.pk, journal_object.seq + count
+                    if many:
+                        serializer.save(journal=journal_object)
+                    else:
+                        serializer.save(journal=journal_object, seq=journal_object.seq + 1)
+
+                    transaction.on_commit(lambda: notifications.publish(journal_id, seq))
             except IntegrityError:
                 content = {'code': 'integrity_error'}
                 return Response(content, status=status.HTTP_400_BAD_REQUEST)
@@ -203,6 +661,56 @@ class EntryViewSet(BaseViewSet):
         return Response(status=status.HTTP_403_FORBIDDEN)
 
 
+class SnapshotViewSet(BaseViewSet):
+    allowed_methods = ['GET', 'POST']
+    permission_classes = BaseViewSet.permission_classes + (permissions.IsMemberReadOnly, )
+    queryset = Snapshot.objects.all()
+    serializer_class = SnapshotSerializer
+    lookup_field = 'entry__uid'
+    lookup_url_kwarg = 'uid'
+
+    def get_queryset(self):
+        journal_access = self.get_journal_access()
+        if journal_access is None:
+            return type(self).queryset.none()
+        return type(self).queryset.filter(journal_id=journal_access.journal_id).select_related('entry') \
+            .defer('entry__content')
+
+    def list(self, request, journal_uid=None):
+        # Only the latest snapshot is kept, so this is either empty or just it
+        self.get_journal_access_or_404()
+        serializer = self.get_serializer(self.get_queryset(), many=True)
+        return Response(serializer.data)
+
+    def create(self, request, journal_uid=None):
+        journal_id = self.get_journal_access_or_404().journal_id
+        serializer = self.serializer_class(data=request.data, context={'journal_id': journal_id})
+        if serializer.is_valid():
+            with transaction.atomic():
+                # A no-op update locks the journal row (on every backend) so concurrent uploads don't interleave
+                Journal.objects.filter(pk=journal_id).update(seq=F('seq'))
+                entry = serializer.validated_data['entry']
+                if Snapshot.objects.filter(journal_id=journal_id, entry_id__gte=entry.pk).exists():
+                    content = {'code': 'outdated', 'detail': 'A newer snapshot already exists'}
+                    return Response(content, status=status.HTTP_409_CONFLICT)
+
+                snapshot = serializer.save(journal_id=journal_id)
+                Snapshot.objects.filter(journal_id=journal_id).exclude(pk=snapshot.pk).delete()
+
+            return Response({}, status=status.HTTP_201_CREATED)
+
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    def destroy(self, request, journal_uid=None, uid=None):
+        return Response(status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    def update(self, request, journal_uid=None, uid=None):
+        return Response(status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    def partial_update(self, request, journal_uid=None, uid=None):
+        return Response(status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
 class UserInfoViewSet(BaseViewSet):
     lookup_value_regex = '[^/]+'
     permission_classes = BaseViewSet.permission_classes + (permissions.IsOwnerOrReadOnly, )
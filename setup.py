@@ -10,8 +10,12 @@ os.chdir(os.path.normpath(os.path.join(os.path.abspath(__file__), os.pardir)))
 setup(
     name='django-etesync-journal',
     version='1.2.3',
-    packages=find_packages(exclude=['tests*']),
+    packages=find_packages(exclude=['tests*', 'benchmarks*']),
     include_package_data=True,
+    extras_require={
+        # Enables the application/msgpack renderer and parser
+        'msgpack': ['msgpack'],
+    },
     license='AGPL-3.0-only',
     description='The server side implementation of the EteSync protocol.',
     long_description=README,
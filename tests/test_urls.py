@@ -16,7 +16,7 @@ from django.conf.urls import include, url
 
 from rest_framework_nested import routers
 
-from journal import views
+from journal import metrics, views
 
 router = routers.DefaultRouter()
 router.register(r'journals', views.JournalViewSet)
@@ -26,11 +26,13 @@ router.register(r'user', views.UserInfoViewSet)
 journals_router = routers.NestedSimpleRouter(router, r'journals', lookup='journal')
 journals_router.register(r'members', views.MembersViewSet, basename='journal-members')
 journals_router.register(r'entries', views.EntryViewSet, basename='journal-entries')
+journals_router.register(r'snapshots', views.SnapshotViewSet, basename='journal-snapshots')
 
 
 urlpatterns = [
     url(r'^api/v1/', include(router.urls)),
     url(r'^api/v1/', include(journals_router.urls)),
+    url(r'^metrics/$', metrics.metrics_view, name='metrics'),
 ]
 
 # Adding this just for testing, this shouldn't be here normally
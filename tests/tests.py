@@ -12,19 +12,41 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
+import collections
+import datetime
+import io
 import json
 import hashlib
-
-from django.test import TestCase
+import threading
+import time
+import unittest
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.backends.signals import connection_created
+from django.test import TestCase, TransactionTestCase
 from django.test import Client
+from django.test.client import AsyncClientHandler
+from django.test.utils import CaptureQueriesContext
 from django.test.utils import override_settings
-from django.urls import reverse
+from django.urls import resolve, reverse
+from django.utils import timezone
 from django.contrib.auth import get_user_model
 
 from rest_framework import status
-from rest_framework.test import APIClient
+from rest_framework.test import APIClient, force_authenticate
+
+from journal import access, async_views, metrics, models, notifications, purge, routers, serializers, throttling, views
 
-from journal import models, serializers
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 
 User = get_user_model()
@@ -234,6 +256,157 @@ class ApiJournalTestCase(BaseTestCase):
         # Version readonly is handled in test_read_only
         # pass
 
+    def test_etag(self):
+        """Test conditional requests of the journal list"""
+        journal = models.Journal(owner=self.user1, uid=self.get_random_hash(), content=b'test')
+        journal.save()
+        self.client.force_authenticate(user=self.user1)
+
+        response = self.client.get(reverse('journal-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('journal-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+        # Changes to the list change the etag
+        def assert_changed(etag):
+            response = self.client.get(reverse('journal-list'), HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotEqual(response['ETag'], etag)
+            response2 = self.client.get(reverse('journal-list'))
+            self.assertEqual(response['ETag'], response2['ETag'])
+            return response['ETag']
+
+        journal.content = b'changed'
+        journal.save()
+        etag = assert_changed(etag)
+
+        models.Entry(journal=journal, uid=self.get_random_hash(), content=b'test').save()
+        etag = assert_changed(etag)
+
+        journal2 = models.Journal(owner=self.user2, uid=self.get_random_hash(), content=b'test')
+        journal2.save()
+        member = models.JournalMember(journal=journal2, user=self.user1, key=b'key')
+        member.save()
+        etag = assert_changed(etag)
+
+        member.delete()
+        models.JournalMember(journal=journal2, user=self.user1, key=b'key2').save()
+        etag = assert_changed(etag)
+
+        # Other users have a different view
+        self.client.force_authenticate(user=self.user2)
+        response = self.client.get(reverse('journal-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_list_query_count(self):
+        """Listing journals shouldn't cost more queries the more journals we have"""
+        self.client.force_authenticate(user=self.user1)
+
+        def add_journals(count):
+            for i in range(count):
+                journal = models.Journal(owner=self.user2, uid=self.get_random_hash(), content=b'test')
+                journal.save()
+                models.JournalMember(journal=journal, user=self.user1, key=b'key', readOnly=(i % 2 == 0)).save()
+                models.Entry(journal=journal, uid=self.get_random_hash(), content=b'entry').save()
+                journal = models.Journal(owner=self.user1, uid=self.get_random_hash(), content=b'test')
+                journal.save()
+
+        def count_list_queries():
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(reverse('journal-list'))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return len(context), response.data
+
+        add_journals(1)
+        small_count, data = count_list_queries()
+        self.assertEqual(len(data), 2)
+
+        add_journals(5)
+        large_count, data = count_list_queries()
+        self.assertEqual(len(data), 12)
+        self.assertEqual(small_count, large_count)
+
+        # And the values are still the same as when computed one by one
+        listed = {journal['uid']: journal for journal in data}
+        for journal in models.Journal.objects.all():
+            member = journal.members.filter(user=self.user1).first()
+            self.assertEqual(listed[journal.uid]['readOnly'], member.readOnly if member else False)
+            self.assertEqual(listed[journal.uid]['key'], serializers.BinaryBase64Field().to_representation(member.key) if member else None)
+            last = models.Entry.objects.filter(journal=journal).last()
+            self.assertEqual(listed[journal.uid]['lastUid'], last.uid if last else None)
+            self.assertEqual(listed[journal.uid]['owner'], journal.owner.username)
+
+    def test_metadata_only(self):
+        """Updating and deleting don't read the journal's content"""
+        journal = models.Journal.objects.create(owner=self.user1, uid=self.get_random_hash(), content=b'test')
+        self.client.force_authenticate(user=self.user1)
+
+        def content_reads():
+            return [query['sql'] for query in context.captured_queries
+                    if query['sql'].startswith('SELECT') and '"journal_journal"."content"' in query['sql']]
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.put(reverse('journal-detail', kwargs={'uid': journal.uid}), {'content': 'bmV3'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertListEqual(content_reads(), [])
+        journal.refresh_from_db()
+        self.assertEqual(bytes(journal.content), b'new')
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.delete(reverse('journal-detail', kwargs={'uid': journal.uid}))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertListEqual(content_reads(), [])
+        journal.refresh_from_db()
+        self.assertTrue(journal.deleted)
+        self.assertEqual(bytes(journal.content), b'new')
+
+    def test_concurrent_append(self):
+        """Updating and deleting don't undo an append made after the journal was read"""
+        journal = models.Journal.objects.create(owner=self.user1, uid=self.get_random_hash(), content=b'test')
+        self.client.force_authenticate(user=self.user1)
+        entries = []
+        get_object = views.JournalViewSet.get_object
+
+        def get_object_then_append(view):
+            obj = get_object(view)
+            entries.append(models.Entry.objects.create(journal=journal, uid=self.get_random_hash(), content=b'test'))
+            return obj
+
+        with mock.patch.object(views.JournalViewSet, 'get_object', get_object_then_append):
+            response = self.client.put(reverse('journal-detail', kwargs={'uid': journal.uid}), {'content': 'bmV3'})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            response = self.client.delete(reverse('journal-detail', kwargs={'uid': journal.uid}))
+            self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        journal.refresh_from_db()
+        self.assertEqual(bytes(journal.content), b'new')
+        self.assertTrue(journal.deleted)
+        self.assertEqual(journal.last_entry_id, entries[-1].pk)
+        self.assertEqual(journal.entry_count, 2)
+        self.assertEqual(journal.seq, 2)
+
+    def test_list_access(self):
+        """Every accessible journal is listed exactly once, without a DISTINCT over the blobs"""
+        user3 = User.objects.create(username='user3', email='user3@localhost')
+        owned = models.Journal.objects.create(owner=self.user1, uid=self.get_random_hash(), content=b'test')
+        shared = models.Journal.objects.create(owner=self.user2, uid=self.get_random_hash(), content=b'test')
+        deleted = models.Journal.objects.create(owner=self.user2, uid=self.get_random_hash(), content=b'test',
+                                                deleted=True)
+        models.Journal.objects.create(owner=self.user2, uid=self.get_random_hash(), content=b'test')
+        for journal in (owned, shared, deleted):
+            models.JournalMember.objects.create(journal=journal, user=user3, key=b'key')
+            models.JournalMember.objects.create(journal=journal, user=self.user1, key=b'key')
+
+        self.client.force_authenticate(user=self.user1)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('journal-list'))
+        self.assertListEqual(sorted(journal['uid'] for journal in response.data), sorted([owned.uid, shared.uid]))
+        self.assertFalse(any('DISTINCT' in query['sql'] for query in context.captured_queries))
+
     def test_filler(self):
         """Extra calls to cheat coverage (things we don't really care about)"""
         str(models.Journal(uid=self.get_random_hash(), content=b'1'))
@@ -242,6 +415,7 @@ class ApiJournalTestCase(BaseTestCase):
 class ApiOldEntryTestCase(BaseTestCase):
     LIST = 'entry-list'
     DETAIL = 'entry-detail'
+    streaming_supported = True
 
     def setUp(self):
         super().setUp()
@@ -469,6 +643,283 @@ class ApiOldEntryTestCase(BaseTestCase):
         response = self.client.post(reverse(self.LIST, kwargs={'journal_uid': self.journal.uid}), self.serializer(entry).data)
         self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
 
+    def test_fetch_with_last_queries(self):
+        """Fetching with last should be a single query, and only need another to tell apart an empty response"""
+        entry = models.Entry(journal=self.journal, uid=self.get_random_hash(), content=b'1')
+        entry.save()
+        entry2 = models.Entry(journal=self.journal, uid=self.get_random_hash(), content=b'2')
+        entry2.save()
+        self.client.force_authenticate(user=self.user1)
+        # Warm up (the access cache, if enabled)
+        self.client.get(reverse('journal-list'))
+
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse(self.LIST, kwargs={'journal_uid': self.journal.uid}) + '?last={}'.format(entry.uid))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 1)
+
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse(self.LIST, kwargs={'journal_uid': self.journal.uid}) + '?last={}'.format(entry2.uid))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 0)
+
+        # Entries of a journal we can't access still 404
+        self.client.force_authenticate(user=self.user2)
+        response = self.client.get(reverse(self.LIST, kwargs={'journal_uid': self.journal.uid}) + '?last={}'.format(entry.uid))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_etag(self):
+        """Test conditional requests of the entries list"""
+        entry = models.Entry(journal=self.journal, uid=self.get_random_hash(), content=b'1')
+        entry.save()
+        self.client.force_authenticate(user=self.user1)
+        url = reverse(self.LIST, kwargs={'journal_uid': self.journal.uid})
+
+        for query in ('', '?last={}'.format(entry.uid), '?limit=1'):
+            response = self.client.get(url + query)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            etag = response['ETag']
+
+            with self.assertNumQueries(1):
+                response = self.client.get(url + query, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(response['ETag'], etag)
+
+        # Different queries have different etags
+        response = self.client.get(url)
+        response2 = self.client.get(url + '?last={}'.format(entry.uid))
+        self.assertNotEqual(response['ETag'], response2['ETag'])
+        etag = response2['ETag']
+
+        # A new entry invalidates it
+        entry2 = models.Entry(journal=self.journal, uid=self.get_random_hash(), content=b'2')
+        entry2.save()
+        response = self.client.get(url + '?last={}'.format(entry.uid), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 1)
+        self.assertNotEqual(response['ETag'], etag)
+
+        # No access, no etag
+        self.client.force_authenticate(user=self.user2)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(response.has_header('ETag'))
+
+        response = self.client.get(url + '?last={}'.format(self.get_random_hash()), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def get_streamed(self, response):
+        """The entries of a response that's streamed (if supported)"""
+        self.assertEqual(response.streaming, self.streaming_supported)
+        return json.loads(b''.join(response.streaming_content) if response.streaming else response.content)
+
+    @override_settings(JOURNAL_STREAM_ENTRIES=True, JOURNAL_STREAM_CHUNK_SIZE=2)
+    def test_streaming(self):
+        """Test streaming the entries returns the same as the non-streamed response"""
+        self.client.force_authenticate(user=self.user1)
+        url = reverse(self.LIST, kwargs={'journal_uid': self.journal.uid})
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertListEqual(self.get_streamed(response), [])
+
+        for i in range(5):
+            models.Entry(journal=self.journal, uid=self.get_random_hash(), content=bytes([i])).save()
+
+        expected = self.serializer(models.Entry.objects.filter(journal=self.journal), many=True).data
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertListEqual(self.get_streamed(response), expected)
+
+        response = self.client.get(url + '?last={}'.format(expected[0]['uid']))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertListEqual(self.get_streamed(response), expected[1:])
+
+        # Paginated requests aren't streamed
+        response = self.client.get(url + '?limit=2')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.streaming)
+        self.assertEqual(len(response.data), 2)
+
+        # Errors are still raised before we start streaming
+        response = self.client.get(url + '?last={}'.format(self.get_random_hash()))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        self.client.force_authenticate(user=self.user2)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_pagination(self):
+        """Test following the pagination links"""
+        entries = []
+        for i in range(5):
+            entry = models.Entry(journal=self.journal, uid=self.get_random_hash(), content=bytes([i]))
+            entry.save()
+            entries.append(entry.uid)
+        self.client.force_authenticate(user=self.user1)
+
+        url = reverse(self.LIST, kwargs={'journal_uid': self.journal.uid}) + '?limit=2'
+        fetched = []
+        while url is not None:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data), 2)
+            fetched += [entry['uid'] for entry in response.data]
+            link = response.get('Link', None)
+            url = link[1:link.index('>; rel="next"')] if link else None
+        self.assertListEqual(fetched, entries)
+
+        ## With last
+        response = self.client.get(reverse(self.LIST, kwargs={'journal_uid': self.journal.uid}) + '?last={}&limit=3'.format(entries[2]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertListEqual([entry['uid'] for entry in response.data], entries[3:])
+        self.assertFalse(response.has_header('Link'))
+
+        ## Limit is capped
+        with override_settings(JOURNAL_MAX_PAGE_SIZE=3):
+            response = self.client.get(reverse(self.LIST, kwargs={'journal_uid': self.journal.uid}) + '?limit=100')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(response.data), 3)
+            self.assertIn('last={}'.format(entries[2]), response['Link'])
+
+    def test_journal_resolved_once(self):
+        """Appending should only look the journal up once (and lock it with an update)"""
+        self.client.force_authenticate(user=self.user1)
+        models.JournalMember(journal=self.journal, user=self.user1, key=b'key').save()
+        # Warm up (the access cache, if enabled)
+        self.client.get(reverse('journal-list'))
+
+        entry = models.Entry(uid=self.get_random_hash(), content=b'test')
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(reverse(self.LIST, kwargs={'journal_uid': self.journal.uid}), self.serializer(entry).data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        journal_selects = [query['sql'] for query in context.captured_queries
+                           if query['sql'].startswith('SELECT') and 'FROM "journal_journal"' in query['sql']]
+        self.assertEqual(len(journal_selects), 1)
+
+    def test_metadata_only(self):
+        """Appending doesn't read any content"""
+        self.client.force_authenticate(user=self.user1)
+        url = reverse(self.LIST, kwargs={'journal_uid': self.journal.uid})
+        entry = models.Entry.objects.create(journal=self.journal, uid=self.get_random_hash(), content=b'test')
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(url + '?last={}'.format(entry.uid), self.serializer(models.Entry(uid=self.get_random_hash(), content=b'test')).data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        for query in context.captured_queries:
+            if query['sql'].startswith('SELECT'):
+                self.assertNotIn('"content"', query['sql'])
+
+    def test_bulk_create(self):
+        """Test adding many entries at once"""
+        self.client.force_authenticate(user=self.user1)
+        url = reverse(self.LIST, kwargs={'journal_uid': self.journal.uid})
+
+        def post(count, last=None):
+            entries = [models.Entry(uid=self.get_random_hash(), content=b'test') for _ in range(count)]
+            query = '?last={}'.format(last) if last is not None else ''
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.post(url + query, json.dumps(self.serializer(entries, many=True).data), content_type='application/json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            return entries, len(context)
+
+        self.client.get(url)  # Warm up any caches
+        entries, small_count = post(2)
+        entries2, large_count = post(30, entries[-1].uid)
+        self.assertEqual(small_count, large_count)
+
+        response = self.client.get(url)
+        self.assertListEqual([entry['uid'] for entry in response.data], [entry.uid for entry in entries + entries2])
+        self.journal.refresh_from_db()
+        self.assertEqual(self.journal.last_entry.uid, entries2[-1].uid)
+        self.assertEqual(self.journal.entry_count, 32)
+
+        # Errors are still reported per entry
+        data = self.serializer([models.Entry(uid=self.get_random_hash(), content=b'test')] * 2, many=True).data
+        data[1]['uid'] = 'a' * 63
+        response = self.client.post(url + '?last={}'.format(entries2[-1].uid), json.dumps(data), content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], {})
+        self.assertIn('uid', response.data[1])
+
+        del data[1]['uid']
+        response = self.client.post(url + '?last={}'.format(entries2[-1].uid), json.dumps(data), content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('uid', response.data[1])
+
+        # Duplicate uids in the same batch
+        data[1]['uid'] = data[0]['uid']
+        response = self.client.post(url + '?last={}'.format(entries2[-1].uid), json.dumps(data), content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.journal.refresh_from_db()
+        self.assertEqual(self.journal.entry_count, 32)
+
+    def test_last_entry(self):
+        """Verify the journal's last entry and entry count are kept up to date"""
+        self.assertIsNone(self.journal.last_entry)
+        self.assertEqual(self.journal.entry_count, 0)
+        self.client.force_authenticate(user=self.user1)
+
+        entry = models.Entry(uid=self.get_random_hash(), content=b'test')
+        response = self.client.post(reverse(self.LIST, kwargs={'journal_uid': self.journal.uid}), self.serializer(entry).data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        self.journal.refresh_from_db()
+        self.assertEqual(self.journal.last_entry.uid, entry.uid)
+        self.assertEqual(self.journal.entry_count, 1)
+
+        multi = [models.Entry(uid=self.get_random_hash(), content=b'test') for _ in range(3)]
+        response = self.client.post(reverse(self.LIST, kwargs={'journal_uid': self.journal.uid}) + '?last={}'.format(entry.uid), json.dumps(self.serializer(multi, many=True).data), content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        self.journal.refresh_from_db()
+        self.assertEqual(self.journal.last_entry.uid, multi[-1].uid)
+        self.assertEqual(self.journal.entry_count, 4)
+
+        # A conflicting push doesn't change anything
+        response = self.client.post(reverse(self.LIST, kwargs={'journal_uid': self.journal.uid}) + '?last={}'.format(entry.uid), self.serializer(models.Entry(uid=self.get_random_hash(), content=b'test')).data)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+        self.journal.refresh_from_db()
+        self.assertEqual(self.journal.last_entry.uid, multi[-1].uid)
+        self.assertEqual(self.journal.entry_count, 4)
+
+        response = self.client.get(reverse('journal-detail', kwargs={'uid': self.journal.uid}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['lastUid'], multi[-1].uid)
+
+    def test_seq(self):
+        """Verify entries get consecutive sequence numbers however they are added"""
+        self.client.force_authenticate(user=self.user1)
+        url = reverse(self.LIST, kwargs={'journal_uid': self.journal.uid})
+
+        entry = models.Entry(uid=self.get_random_hash(), content=b'test')
+        response = self.client.post(url, self.serializer(entry).data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        multi = [models.Entry(uid=self.get_random_hash(), content=b'test') for _ in range(3)]
+        response = self.client.post(url + '?last={}'.format(entry.uid), json.dumps(self.serializer(multi, many=True).data), content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        direct = models.Entry.objects.create(uid=self.get_random_hash(), content=b'test', journal=self.journal)
+        self.assertEqual(direct.seq, 5)
+
+        self.assertListEqual(list(models.Entry.objects.filter(journal=self.journal).values_list('seq', flat=True)),
+                             [1, 2, 3, 4, 5])
+        self.journal.refresh_from_db()
+        self.assertEqual(self.journal.seq, 5)
+
+        # Other journals have their own sequence
+        journal2 = models.Journal.objects.create(owner=self.user1, uid=self.get_random_hash(), content=b'test')
+        other = models.Entry.objects.create(uid=self.get_random_hash(), content=b'test', journal=journal2)
+        self.assertEqual(other.seq, 1)
+
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                models.Entry.objects.create(uid=self.get_random_hash(), content=b'test', journal=self.journal, seq=5)
+
     def test_filler(self):
         """Extra calls to cheat coverage (things we don't really care about)"""
         str(models.Entry(uid=self.get_random_hash(), content=b'1'))
@@ -718,6 +1169,26 @@ class JournalMembersTestCase(BaseTestCase):
         # Just to complete coverage
         str(journal_member)
 
+    def test_no_access(self):
+        """Members of journals we can't access can't be touched"""
+        journal = models.Journal(owner=self.user2, uid=self.get_random_hash(), content=b'user2')
+        journal.save()
+        user3 = User.objects.create(username='user3', email='user3@localhost')
+        models.JournalMember(journal=journal, user=user3, key=b'somekey').save()
+
+        self.client.force_authenticate(user=self.user1)
+        response = self.client.get(reverse('journal-members-list', kwargs={'journal_uid': journal.uid}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        response = self.client.delete(reverse('journal-members-detail', kwargs={'journal_uid': journal.uid, 'username': user3.username}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertTrue(models.JournalMember.objects.filter(journal=journal, user=user3).exists())
+
+        # A member that isn't the owner can't either
+        self.client.force_authenticate(user=user3)
+        response = self.client.delete(reverse('journal-members-detail', kwargs={'journal_uid': journal.uid, 'username': user3.username}))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
     def test_read_only(self):
         """Tests for read only JournalMembers"""
         journal1 = models.Journal(owner=self.user1, uid=self.get_random_hash(), content=b'user1')
@@ -762,6 +1233,1164 @@ class JournalMembersTestCase(BaseTestCase):
         self.assertEqual(len(response.data), 1)
 
 
+@unittest.skipUnless(msgpack, 'msgpack is not installed')
+class MessagePackTestCase(BaseTestCase):
+    def request(self, method, url, data=None):
+        kwargs = {'HTTP_ACCEPT': 'application/msgpack'}
+        if data is not None:
+            kwargs.update(data=msgpack.packb(data, use_bin_type=True), content_type='application/msgpack')
+        response = getattr(self.client, method)(url, **kwargs)
+        if response.content:
+            self.assertEqual(response['Content-Type'], 'application/msgpack')
+            return response, msgpack.unpackb(response.content, raw=False)
+        return response, None
+
+    def test_basic(self):
+        """Binary data is passed as raw bytes both ways"""
+        self.client.force_authenticate(user=self.user1)
+        journal_uid = self.get_random_hash()
+
+        # Journals
+        response, _ = self.request('post', reverse('journal-list'), {'uid': journal_uid, 'content': b'\x00journal'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(models.Journal.objects.get(uid=journal_uid).content, b'\x00journal')
+
+        response, data = self.request('get', reverse('journal-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(data[0]['content'], b'\x00journal')
+
+        # Entries
+        entries = [{'uid': self.get_random_hash(), 'content': bytes([i, 0xff])} for i in range(3)]
+        response, _ = self.request('post', reverse('journal-entries-list', kwargs={'journal_uid': journal_uid}), entries)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        response, data = self.request('get', reverse('journal-entries-list', kwargs={'journal_uid': journal_uid}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertListEqual(data, entries)
+
+        # Members
+        response, _ = self.request('post', reverse('journal-members-list', kwargs={'journal_uid': journal_uid}),
+                                   {'user': self.user2.username, 'key': b'\x01key'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        response, data = self.request('get', reverse('journal-members-list', kwargs={'journal_uid': journal_uid}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(data[0]['key'], b'\x01key')
+
+        self.client.force_authenticate(user=self.user2)
+        response, data = self.request('get', reverse('journal-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(data[0]['key'], b'\x01key')
+
+        # User info
+        response, _ = self.request('post', reverse('userinfo-list'), {'pubkey': b'\x02pubkey', 'content': b'\x03content'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        response, data = self.request('get', reverse('userinfo-detail', kwargs={'username': self.user2.username}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(data, {'version': 1, 'pubkey': b'\x02pubkey', 'content': b'\x03content'})
+
+        # JSON is still the default
+        response = self.client.get(reverse('userinfo-detail', kwargs={'username': self.user2.username}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['pubkey'], serializers.BinaryBase64Field().to_representation(b'\x02pubkey'))
+
+        # Errors
+        response, data = self.request('get', reverse('journal-entries-list', kwargs={'journal_uid': self.get_random_hash()}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertIn('detail', data)
+
+
+class CommittingMixin:
+    """Runs the test case's tests without wrapping them in a transaction (like TransactionTestCase does)
+
+    The access cache is invalidated once changes are committed, which never happens inside of the transaction.
+    """
+
+    @classmethod
+    def _databases_support_transactions(cls):
+        return False
+
+
+@override_settings(JOURNAL_ACCESS_CACHE='default')
+class CachedAccessEntryTestCase(CommittingMixin, ApiEntryTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+
+@override_settings(JOURNAL_ACCESS_CACHE='default')
+class CachedAccessJournalMembersTestCase(CommittingMixin, JournalMembersTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def test_cached(self):
+        """Permission checks are answered from the cache, and changes invalidate it"""
+        journal = models.Journal(owner=self.user2, uid=self.get_random_hash(), content=b'user2')
+        journal.save()
+        entry = models.Entry(uid=self.get_random_hash(), content=b'test')
+        url = reverse('journal-entries-list', kwargs={'journal_uid': journal.uid})
+
+        self.client.force_authenticate(user=self.user1)
+        response = self.client.get(reverse('journal-list'))
+        self.assertEqual(len(response.data), 0)
+        response = self.client.post(url, serializers.EntrySerializer(entry).data)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        # Sharing invalidates the cache
+        member = models.JournalMember(journal=journal, user=self.user1, key=b'somekey', readOnly=True)
+        member.save()
+        response = self.client.get(reverse('journal-list'))
+        self.assertEqual(len(response.data), 1)
+
+        # The read only check doesn't hit the db at all
+        with self.assertNumQueries(0):
+            response = self.client.post(url, serializers.EntrySerializer(entry).data)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        # Revoking invalidates the cache
+        member.delete()
+        response = self.client.post(url, serializers.EntrySerializer(entry).data)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        models.JournalMember(journal=journal, user=self.user1, key=b'somekey').save()
+        response = self.client.post(url, serializers.EntrySerializer(entry).data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        # So does deleting the journal
+        self.client.force_authenticate(user=self.user2)
+        response = self.client.delete(reverse('journal-detail', kwargs={'uid': journal.uid}))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        self.client.force_authenticate(user=self.user1)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get(reverse('journal-list'))
+        self.assertEqual(len(response.data), 0)
+
+    def test_invalidated_on_commit(self):
+        """The cache is only invalidated once the change is committed"""
+        journal = models.Journal.objects.create(owner=self.user2, uid=self.get_random_hash(), content=b'user2')
+        member = models.JournalMember.objects.create(journal=journal, user=self.user1, key=b'somekey')
+        self.client.force_authenticate(user=self.user1)
+        response = self.client.get(reverse('journal-list'))
+        self.assertEqual(len(response.data), 1)
+
+        version_key = access._version_key(self.user1.pk)
+        with transaction.atomic():
+            version = cache.get(version_key)
+            member.delete()
+            # A map built now (from the uncommitted change) is cached under the version that's about to be replaced
+            self.assertEqual(cache.get(version_key), version)
+        self.assertNotEqual(cache.get(version_key), version)
+
+        response = self.client.get(reverse('journal-list'))
+        self.assertEqual(len(response.data), 0)
+
+
+class NotificationsTestCase(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.journal = models.Journal.objects.create(owner=self.user1, uid=self.get_random_hash(), content=b'test')
+        self.url = reverse('journal-changes')
+        # Start every test with fresh backends
+        notifications._backends.clear()
+
+    def test_changes(self):
+        """The changes endpoint returns the journals whose last entry differs"""
+        entry = models.Entry.objects.create(journal=self.journal, uid=self.get_random_hash(), content=b'test')
+        journal2 = models.Journal.objects.create(owner=self.user1, uid=self.get_random_hash(), content=b'test')
+        journal3 = models.Journal.objects.create(owner=self.user2, uid=self.get_random_hash(), content=b'test')
+
+        response = self.client.post(self.url, {self.journal.uid: None}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        self.client.force_authenticate(user=self.user1)
+        data = {self.journal.uid: None, journal2.uid: None, journal3.uid: None}
+        response = self.client.post(self.url + '?timeout=0', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {self.journal.uid: entry.uid})
+
+        # Nothing changed
+        data = {self.journal.uid: entry.uid, journal2.uid: None}
+        response = self.client.post(self.url + '?timeout=0', data, format='json')
+        self.assertEqual(response.data, {})
+
+        # Bad requests
+        response = self.client.post(self.url, [self.journal.uid], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(self.url, {self.journal.uid: 3}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_publish_on_append(self):
+        """Appending publishes the new seq once committed"""
+        backend = notifications.get_backend()
+        self.client.force_authenticate(user=self.user1)
+        entries = [models.Entry(uid=self.get_random_hash(), content=b'test') for _ in range(2)]
+        url = reverse('journal-entries-list', kwargs={'journal_uid': self.journal.uid})
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            response = self.client.post(url, json.dumps(serializers.EntrySerializer(entries, many=True).data), content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(backend.wait({self.journal.pk: 0}, 0), {self.journal.pk})
+        self.assertEqual(backend.wait({self.journal.pk: 2}, 0), set())
+
+    def test_in_process_backend(self):
+        """Waiters are woken up by a publish from another thread"""
+        backend = notifications.InProcessNotificationBackend()
+        timer = threading.Timer(0.05, backend.publish, args=(self.journal.pk, 1))
+        timer.start()
+        self.assertEqual(backend.wait({self.journal.pk: 0, self.journal.pk + 1: 0}, 5), {self.journal.pk})
+        timer.join()
+        self.assertEqual(backend.wait({self.journal.pk: 1}, 0.01), set())
+
+    def test_in_process_backend_bounded(self):
+        """Only the most recently appended to journals are remembered"""
+        backend = notifications.InProcessNotificationBackend()
+        backend.max_journals = 2
+        for journal_id, seq in ((1, 1), (2, 1), (1, 2), (3, 1)):
+            backend.publish(journal_id, seq)
+        self.assertEqual(list(backend.latest.keys()), [1, 3])
+        self.assertEqual(backend.wait({1: 0, 2: 0, 3: 0}, 0), {1, 3})
+
+    @override_settings(JOURNAL_NOTIFICATION_BACKEND='journal.notifications.DatabasePollingNotificationBackend',
+                       JOURNAL_NOTIFICATION_POLL_INTERVAL=0.01)
+    def test_database_polling_backend(self):
+        """The polling backend notices changes made by anyone"""
+        models.Entry.objects.create(journal=self.journal, uid=self.get_random_hash(), content=b'test')
+        backend = notifications.get_backend()
+        self.assertIsInstance(backend, notifications.DatabasePollingNotificationBackend)
+        self.assertEqual(backend.wait({self.journal.pk: 0}, 1), {self.journal.pk})
+        self.assertEqual(backend.wait({self.journal.pk: 1}, 0.05), set())
+
+        self.client.force_authenticate(user=self.user1)
+        response = self.client.post(self.url + '?timeout=0.05', {self.journal.uid: None}, format='json')
+        self.assertEqual(len(response.data), 1)
+
+
+class SyncTestCase(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('journal-sync')
+        self.journals = [models.Journal.objects.create(owner=self.user1, uid=self.get_random_hash(), content=b'test')
+                         for _ in range(3)]
+        self.entries = {}
+        for journal in self.journals:
+            self.entries[journal.uid] = [
+                models.Entry.objects.create(journal=journal, uid=self.get_random_hash(), content=b'test')
+                for _ in range(3)]
+
+    def test_sync(self):
+        """Fetch the new entries of many journals in one request"""
+        other = models.Journal.objects.create(owner=self.user2, uid=self.get_random_hash(), content=b'test')
+        journal1, journal2, journal3 = self.journals
+
+        response = self.client.post(self.url, {journal1.uid: None}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        self.client.force_authenticate(user=self.user1)
+        data = {
+            journal1.uid: None,
+            journal2.uid: self.entries[journal2.uid][0].uid,
+            journal3.uid: self.entries[journal3.uid][-1].uid,
+            other.uid: None,
+        }
+        with self.assertNumQueries(2 + 3):
+            response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.data.keys()), {journal1.uid, journal2.uid, journal3.uid})
+
+        def uids(entries):
+            return [entry['uid'] for entry in entries]
+
+        self.assertEqual(uids(response.data[journal1.uid]['entries']), [x.uid for x in self.entries[journal1.uid]])
+        self.assertEqual(uids(response.data[journal2.uid]['entries']), [x.uid for x in self.entries[journal2.uid][1:]])
+        self.assertEqual(response.data[journal3.uid], {'entries': [], 'next': None})
+        self.assertEqual(response.data[journal1.uid]['entries'][0]['content'],
+                         serializers.EntrySerializer(self.entries[journal1.uid][0]).data['content'])
+
+        # Unknown last entries are reported per journal
+        response = self.client.post(self.url, {journal1.uid: self.get_random_hash()}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[journal1.uid]['code'], 'not_found')
+
+        response = self.client.post(self.url, [journal1.uid], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_sync_limit(self):
+        """Every journal is limited separately and can be continued from its cursor"""
+        self.client.force_authenticate(user=self.user1)
+        data = {journal.uid: None for journal in self.journals}
+
+        fetched = {journal.uid: [] for journal in self.journals}
+        while len(data) > 0:
+            response = self.client.post(self.url + '?limit=2', data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            data = {}
+            for uid, result in response.data.items():
+                self.assertLessEqual(len(result['entries']), 2)
+                fetched[uid] += [entry['uid'] for entry in result['entries']]
+                if result['next'] is not None:
+                    data[uid] = result['next']
+
+        for journal in self.journals:
+            self.assertEqual(fetched[journal.uid], [entry.uid for entry in self.entries[journal.uid]])
+
+    @override_settings(JOURNAL_SYNC_MAX_JOURNALS=2, JOURNAL_SYNC_MAX_ENTRIES=4)
+    def test_sync_bounds(self):
+        """The number of journals and the total number of entries of a request are bounded"""
+        self.client.force_authenticate(user=self.user1)
+        journal1, journal2, journal3 = self.journals
+        entries1, entries2 = self.entries[journal1.uid], self.entries[journal2.uid]
+
+        response = self.client.post(self.url, {journal.uid: None for journal in self.journals}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['code'], 'too_many_journals')
+
+        # The entries are taken from the journals in the order they're asked for
+        data = collections.OrderedDict([(journal2.uid, None), (journal1.uid, None)])
+        response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data[journal2.uid]['entries']), 3)
+        self.assertEqual(response.data[journal2.uid]['next'], None)
+        self.assertEqual(len(response.data[journal1.uid]['entries']), 1)
+        self.assertEqual(response.data[journal1.uid]['next'], entries1[0].uid)
+
+        # Once the budget is spent every journal still gets one entry to continue from
+        with override_settings(JOURNAL_SYNC_MAX_ENTRIES=2):
+            data = collections.OrderedDict([(journal1.uid, None), (journal2.uid, entries2[0].uid)])
+            response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.data[journal1.uid]['next'], entries1[1].uid)
+        self.assertEqual(len(response.data[journal2.uid]['entries']), 1)
+        self.assertEqual(response.data[journal2.uid]['next'], entries2[1].uid)
+
+
+class ASGIForceAuthClientHandler(AsyncClientHandler):
+    """Serves the (sync) test client's requests through Django's ASGI request handling"""
+
+    def __init__(self, *args, **kwargs):
+        self._force_user = None
+        self._force_token = None
+        super().__init__(*args, **kwargs)
+
+    async def get_response_async(self, request):
+        force_authenticate(request, self._force_user, self._force_token)
+        return await super().get_response_async(request)
+
+    def __call__(self, environ):
+        headers = [(key[5:].replace('_', '-').lower().encode('latin1'), str(value).encode('latin1'))
+                   for key, value in environ.items() if key.startswith('HTTP_')]
+        for key in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            if key in environ:
+                headers.append((key.replace('_', '-').lower().encode('latin1'), str(environ[key]).encode('latin1')))
+
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'scheme': environ['wsgi.url_scheme'],
+            'server': (environ['SERVER_NAME'], int(environ['SERVER_PORT'])),
+            'client': ('127.0.0.1', 0),
+            'method': environ['REQUEST_METHOD'],
+            'path': environ['PATH_INFO'].encode('iso-8859-1').decode('utf-8'),
+            'root_path': environ.get('SCRIPT_NAME', ''),
+            'query_string': environ.get('QUERY_STRING', '').encode('latin1'),
+            'headers': headers,
+            '_body_file': environ['wsgi.input'],
+        }
+        response = async_to_sync(super().__call__)(scope)
+        response.wsgi_request = response.asgi_request
+        return response
+
+
+class ASGIAPIClient(APIClient):
+    def __init__(self, enforce_csrf_checks=False, **defaults):
+        super().__init__(enforce_csrf_checks, **defaults)
+        self.handler = ASGIForceAuthClientHandler(enforce_csrf_checks)
+
+
+class ASGIMixin:
+    """Runs a test case against the async views, through Django's ASGI request handling"""
+
+    def setUp(self):
+        overrides = override_settings(ROOT_URLCONF='tests.test_async_urls', JOURNAL_ASYNC_THREADS=0)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        super().setUp()
+        self.client = ASGIAPIClient()
+
+
+class ASGIApiJournalTestCase(ASGIMixin, ApiJournalTestCase):
+    pass
+
+
+class ASGIApiEntryTestCase(ASGIMixin, ApiEntryTestCase):
+    streaming_supported = async_views.STREAMING_SUPPORTED
+
+
+class ASGIUserInfoTestCase(ASGIMixin, UserInfoTestCase):
+    pass
+
+
+class ASGIJournalMembersTestCase(ASGIMixin, JournalMembersTestCase):
+    pass
+
+
+class ASGISyncTestCase(ASGIMixin, SyncTestCase):
+    pass
+
+
+@override_settings(ROOT_URLCONF='tests.test_async_urls')
+class AsyncViewsTestCase(TransactionTestCase):
+    def test_async_views(self):
+        """The read heavy endpoints are served by async views"""
+        for url in ('/api/v1/journals/', '/api/v1/journal/{}/'.format('a' * 64), '/api/v1/user/user1/'):
+            self.assertTrue(asyncio.iscoroutinefunction(resolve(url).func))
+        self.assertFalse(asyncio.iscoroutinefunction(resolve('/api/v1/journals/{}/members/'.format('a' * 64)).func))
+        self.assertTrue(asyncio.iscoroutinefunction(resolve('/api/v1/journals/changes/').func))
+        self.assertTrue(asyncio.iscoroutinefunction(resolve('/api/v1/journals/sync/').func))
+
+    @override_settings(JOURNAL_STREAM_ENTRIES=True, JOURNAL_STREAM_CHUNK_SIZE=2)
+    def test_thread_pool(self):
+        """The database is accessed from the pool's threads"""
+        user = User.objects.create(username='user1', email='user1@localhost')
+        journal = models.Journal.objects.create(owner=user, uid=hashlib.sha256(b'1').hexdigest(), content=b'test')
+        for i in range(5):
+            models.Entry.objects.create(journal=journal, uid=hashlib.sha256(bytes([i])).hexdigest(), content=b'test')
+
+        # Start with new threads, so they open their connections during the test
+        executor = async_views._executors.pop('journal-db', None)
+        if executor is not None:
+            executor.shutdown()
+        threads = set()
+
+        def record_thread(sender, connection, **kwargs):
+            threads.add(threading.current_thread().name)
+
+        client = ASGIAPIClient()
+        client.force_authenticate(user=user)
+        connection_created.connect(record_thread)
+        try:
+            response = client.get(reverse('journal-entries-list', kwargs={'journal_uid': journal.uid}))
+        finally:
+            connection_created.disconnect(record_thread)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # Older versions of Django can't stream from async views
+        self.assertEqual(response.streaming, async_views.STREAMING_SUPPORTED)
+        content = b''.join(response.streaming_content) if response.streaming else response.content
+        self.assertEqual(len(json.loads(content)), 5)
+        self.assertGreater(len(threads), 0)
+        self.assertTrue(all(name.startswith('journal-db') for name in threads))
+
+    def test_long_poll(self):
+        """A long poll doesn't hold up other requests, even with Django running sync code in a single thread"""
+        user = User.objects.create(username='user1', email='user1@localhost')
+        journal = models.Journal.objects.create(owner=user, uid=hashlib.sha256(b'1').hexdigest(), content=b'test')
+        notifications._backends.clear()
+
+        class ForceAuthASGIHandler(ASGIHandler):
+            async def get_response_async(self, request):
+                force_authenticate(request, user)
+                return await super().get_response_async(request)
+
+        handler = ForceAuthASGIHandler()
+
+        async def request(method, path, query_string=b'', body=b''):
+            scope = {
+                'type': 'http',
+                'asgi': {'version': '3.0'},
+                'http_version': '1.1',
+                'scheme': 'http',
+                'server': ('testserver', 80),
+                'client': ('127.0.0.1', 0),
+                'method': method,
+                'path': path,
+                'root_path': '',
+                'query_string': query_string,
+                'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())],
+            }
+            messages = [{'type': 'http.request', 'body': body}]
+
+            async def receive():
+                if messages:
+                    return messages.pop(0)
+                await asyncio.sleep(60)
+                return {'type': 'http.disconnect'}
+
+            sent = []
+
+            async def send(message):
+                sent.append(message)
+
+            start = time.monotonic()
+            await handler(scope, receive, send)
+            return sent[0]['status'], time.monotonic() - start
+
+        async def run():
+            body = json.dumps({journal.uid: None}).encode()
+            poll = asyncio.ensure_future(request('POST', reverse('journal-changes'), b'timeout=2', body))
+            await asyncio.sleep(0.2)
+            self.assertFalse(poll.done())
+            listed = await request('GET', reverse('journal-list'))
+            return await poll, listed
+
+        (poll_status, poll_time), (list_status, list_time) = async_to_sync(run)()
+        self.assertEqual(poll_status, status.HTTP_200_OK)
+        self.assertEqual(list_status, status.HTTP_200_OK)
+        self.assertGreater(poll_time, 1.5)
+        self.assertLess(list_time, 1)
+
+
+class SnapshotTestCase(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.journal = models.Journal.objects.create(owner=self.user1, uid=self.get_random_hash(), content=b'test')
+        self.entries = [models.Entry.objects.create(journal=self.journal, uid=self.get_random_hash(), content=b'test')
+                        for _ in range(5)]
+        self.url = reverse('journal-snapshots-list', kwargs={'journal_uid': self.journal.uid})
+
+    def test_snapshots(self):
+        """A new device can start from the latest snapshot"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        self.client.force_authenticate(user=self.user1)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertListEqual(response.data, [])
+
+        response = self.client.post(self.url, {'entryUid': self.entries[1].uid, 'content': 'c25hcHNob3Q='})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.post(self.url, {'entryUid': self.entries[2].uid, 'content': 'c25hcHNob3Qy'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        # Older snapshots are rejected
+        response = self.client.post(self.url, {'entryUid': self.entries[1].uid, 'content': 'c25hcHNob3Q='})
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+        # Only the latest is kept
+        response = self.client.get(self.url)
+        self.assertListEqual(response.data, [{'entryUid': self.entries[2].uid, 'content': 'c25hcHNob3Qy'}])
+
+        response = self.client.get(reverse('journal-snapshots-detail', kwargs={'journal_uid': self.journal.uid, 'uid': self.entries[2].uid}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # And then fetch the entries after it
+        response = self.client.get(reverse('journal-entries-list', kwargs={'journal_uid': self.journal.uid}) + '?last={}'.format(self.entries[2].uid))
+        self.assertListEqual([entry['uid'] for entry in response.data], [entry.uid for entry in self.entries[3:]])
+
+        # Entries of other journals (or that don't exist) can't be used
+        journal2 = models.Journal.objects.create(owner=self.user1, uid=self.get_random_hash(), content=b'test')
+        entry2 = models.Entry.objects.create(journal=journal2, uid=self.get_random_hash(), content=b'test')
+        response = self.client.post(self.url, {'entryUid': entry2.uid, 'content': 'c25hcHNob3Q='})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.delete(reverse('journal-snapshots-detail', kwargs={'journal_uid': self.journal.uid, 'uid': self.entries[2].uid}))
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+        # No entries were pruned
+        self.assertEqual(models.Entry.objects.filter(journal=self.journal).count(), 5)
+
+    def test_access(self):
+        """Only members can see snapshots, and only read-write ones can add them"""
+        models.Snapshot.objects.create(journal=self.journal, entry=self.entries[0], content=b'snapshot')
+
+        self.client.force_authenticate(user=self.user2)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.post(self.url, {'entryUid': self.entries[1].uid, 'content': 'c25hcHNob3Q='})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        models.JournalMember.objects.create(journal=self.journal, user=self.user2, key=b'key', readOnly=True)
+        response = self.client.get(self.url)
+        self.assertEqual(len(response.data), 1)
+        response = self.client.post(self.url, {'entryUid': self.entries[1].uid, 'content': 'c25hcHNob3Q='})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    @override_settings(JOURNAL_PRUNE_SNAPSHOT_ENTRIES=True)
+    def test_prune(self):
+        """The entries superseded by a snapshot can be pruned, in the background"""
+        self.client.force_authenticate(user=self.user1)
+        response = self.client.post(self.url, {'entryUid': self.entries[2].uid, 'content': 'c25hcHNob3Q='})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(models.Entry.objects.filter(journal=self.journal).count(), len(self.entries))
+
+        out = io.StringIO()
+        call_command('purge_deleted_journals', '--throttle=0', '--batch-size=1', stdout=out)
+        self.assertIn('Pruned 2 entries', out.getvalue())
+
+        self.assertListEqual(list(models.Entry.objects.filter(journal=self.journal).values_list('uid', flat=True)),
+                             [entry.uid for entry in self.entries[2:]])
+        self.journal.refresh_from_db()
+        self.assertEqual(self.journal.entry_count, 3)
+        self.assertEqual(self.journal.last_entry_id, self.entries[-1].pk)
+
+        # Appending still works
+        entry = models.Entry(uid=self.get_random_hash(), content=b'test')
+        response = self.client.post(reverse('journal-entries-list', kwargs={'journal_uid': self.journal.uid}) + '?last={}'.format(self.entries[-1].uid), serializers.EntrySerializer(entry).data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+
+class PurgeTestCase(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.journals = []
+        for deleted, age in ((True, 40), (True, 40), (True, 1), (False, 40)):
+            journal = models.Journal.objects.create(owner=self.user1, uid=self.get_random_hash(), content=b'test',
+                                                    deleted=deleted)
+            for _ in range(5):
+                models.Entry.objects.create(journal=journal, uid=self.get_random_hash(), content=b'test')
+            models.JournalMember.objects.create(journal=journal, user=self.user2, key=b'key')
+            models.Journal.objects.filter(pk=journal.pk).update(modified=timezone.now() - datetime.timedelta(days=age))
+            self.journals.append(journal)
+
+    def test_purge(self):
+        """Only journals deleted before the grace period are purged"""
+        batches = []
+        journals, entries = purge.purge_deleted_journals(datetime.timedelta(days=30), batch_size=2,
+                                                         progress=lambda journal, deleted: batches.append(deleted))
+        self.assertEqual((journals, entries), (2, 10))
+        self.assertEqual(batches, [2, 4, 5, 2, 4, 5])
+
+        remaining = set(models.Journal.objects.values_list('pk', flat=True))
+        self.assertEqual(remaining, {self.journals[2].pk, self.journals[3].pk})
+        self.assertEqual(models.Entry.objects.count(), 10)
+        self.assertEqual(models.JournalMember.objects.count(), 2)
+
+        # Nothing left to do
+        self.assertEqual(purge.purge_deleted_journals(datetime.timedelta(days=30)), (0, 0))
+
+    def test_queries(self):
+        """Purging doesn't load the content of the entries, snapshots or journals"""
+        journal = self.journals[0]
+        entry = models.Entry.objects.filter(journal=journal).last()
+        models.Snapshot.objects.create(journal=journal, entry=entry, content=b'snapshot')
+
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(purge.purge_journal(journal, batch_size=2), 5)
+        selects = [query['sql'] for query in context.captured_queries if query['sql'].startswith('SELECT')]
+        self.assertGreater(len(selects), 0)
+        # The only ones naming a content column look for journals whose last entry is being deleted, and the
+        # purge clears that first so they find none
+        content_selects = [sql for sql in selects if '"content"' in sql]
+        self.assertGreater(len(content_selects), 0)
+        self.assertTrue(all('"journal_journal"."last_entry_id" IN' in sql for sql in content_selects))
+        # One DELETE per batch
+        deletes = [query['sql'] for query in context.captured_queries
+                   if query['sql'].startswith('DELETE FROM "journal_entry"')]
+        self.assertEqual(len(deletes), 3)
+        self.assertFalse(models.Journal.objects.filter(pk=journal.pk).exists())
+        self.assertFalse(models.Snapshot.objects.exists())
+
+    def test_resume(self):
+        """A partially purged journal is finished off by the next run"""
+        models.Entry.objects.filter(journal=self.journals[0]).order_by('pk')[:1].get().delete()
+        self.assertEqual(purge.purge_deleted_journals(datetime.timedelta(days=30)), (2, 9))
+
+    def test_command(self):
+        """Test the management command"""
+        out = io.StringIO()
+        call_command('purge_deleted_journals', '--dry-run', stdout=out)
+        self.assertIn('2 journals', out.getvalue())
+        self.assertEqual(models.Journal.objects.count(), 4)
+
+        out = io.StringIO()
+        call_command('purge_deleted_journals', '--grace-days=0', '--throttle=0', stdout=out)
+        self.assertIn('Purged 3 journals (15 entries)', out.getvalue())
+        self.assertEqual(models.Journal.objects.count(), 1)
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'The query plans are checked with SQLite')
+class QueryPlanTestCase(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.journal = models.Journal.objects.create(owner=self.user1, uid=self.get_random_hash(), content=b'test')
+        models.JournalMember.objects.create(journal=self.journal, user=self.user2, key=b'key')
+        self.entry = models.Entry.objects.create(journal=self.journal, uid=self.get_random_hash(), content=b'test')
+        self.url = reverse('journal-entries-list', kwargs={'journal_uid': self.journal.uid})
+        self.client.force_authenticate(user=self.user1)
+
+    def get_plans(self, request, table):
+        """The query plans of the SELECTs of table's rows made by request()"""
+        with CaptureQueriesContext(connection) as context:
+            response = request()
+        self.assertLess(response.status_code, 300)
+
+        plans = []
+        for query in context.captured_queries:
+            sql = query['sql']
+            if sql.startswith(('SELECT "{}".'.format(table), 'SELECT DISTINCT "{}".'.format(table))):
+                with connection.cursor() as cursor:
+                    cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                    plans.append('\n'.join(row[-1] for row in cursor.fetchall()))
+        self.assertGreater(len(plans), 0)
+        return plans
+
+    def test_entry_list(self):
+        """Listing entries reads the (journal, id) index in order"""
+        plan, = self.get_plans(lambda: self.client.get(self.url), 'journal_entry')
+        self.assertIn('journal_entry USING INDEX journal_entry_journal_id_idx (journal_id=?)', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_entry_list_last(self):
+        """Fetching the entries after the last one is a range scan of the (journal, id) index"""
+        plan, = self.get_plans(lambda: self.client.get(self.url + '?last={}'.format(self.entry.uid)), 'journal_entry')
+        self.assertIn('journal_entry USING INDEX journal_entry_journal_id_idx (journal_id=? AND id>?)', plan)
+        self.assertIn('COVERING INDEX journal_entry_uid_journal_id', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_append(self):
+        """Appending resolves the journal and the last entry through indexes"""
+        entry = models.Entry(uid=self.get_random_hash(), content=b'test')
+        request = lambda: self.client.post(self.url + '?last={}'.format(self.entry.uid), serializers.EntrySerializer(entry).data)  # noqa: E731
+        plan, = self.get_plans(request, 'journal_journal')
+        self.assertIn('journal_journal USING INDEX journal_journal_uid', plan)
+        self.assertIn('COVERING INDEX journal_entry_uid_journal_id', plan)
+        self.assertNotIn('SCAN', plan)
+
+    def test_journal_list(self):
+        """Listing journals only looks at the live ones"""
+        plan, = self.get_plans(lambda: self.client.get(reverse('journal-list')), 'journal_journal')
+        self.assertIn('journal_live_owner_idx', plan)
+
+    def test_memberships(self):
+        """A user's memberships are read from the covering index"""
+        memberships = models.JournalMember.objects.filter(user=self.user2).values_list('journal_id', 'readOnly')
+        self.assertIn('COVERING INDEX journal_member_access_idx', memberships.explain())
+
+
+class QueryBudgetTestCase(BaseTestCase):
+    # The most queries each endpoint may make, regardless of how much data there is. Savepoints count too.
+    budgets = {
+        'journal_list': 1,
+        'journal_retrieve': 1,
+        'journal_create': 3,
+        'entry_list': 1,
+        'entry_create': 6,
+        # Includes fetching the last entry's id, on the databases that don't return the ids from bulk inserts
+        'entry_bulk_create': 7,
+        'members_list': 2,
+        'user_info': 1,
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.users = [self.user1, self.user2]
+        self.journal = None
+        self.client.force_authenticate(user=self.user1)
+
+    def populate(self, size):
+        """Add size more users, shared journals and entries per journal"""
+        for _ in range(size):
+            user = User.objects.create(username='user{}'.format(len(self.users) + 1))
+            models.UserInfo.objects.create(owner=user, pubkey=b'pubkey', content=b'content')
+            self.users.append(user)
+
+            journal = models.Journal.objects.create(owner=self.user1, uid=self.get_random_hash(), content=b'test')
+            models.JournalMember.objects.create(journal=journal, user=self.user2, key=b'key')
+            for entry in range(size):
+                models.Entry.objects.create(journal=journal, uid=self.get_random_hash(), content=b'test')
+
+            # A journal shared with the other users too, and one user1 is only a member of
+            self.journal = self.journal or journal
+            models.JournalMember.objects.create(journal=self.journal, user=user, key=b'key')
+            journal = models.Journal.objects.create(owner=user, uid=self.get_random_hash(), content=b'test')
+            models.JournalMember.objects.create(journal=journal, user=self.user1, key=b'key', readOnly=True)
+
+    def get_queries(self, prepare):
+        """The SQL of the queries made by the request prepare() returns (prepare's own queries aren't counted)"""
+        request = prepare()
+        with CaptureQueriesContext(connection) as context:
+            response = request()
+        self.assertLess(response.status_code, 300, response.content)
+        return [query['sql'] for query in context.captured_queries]
+
+    def assertQueryBudget(self, name, prepare):
+        """The request doesn't make more queries with more data, and is within the endpoint's budget"""
+        self.populate(2)
+        # Once to warm up whatever is cached, the second time is what's counted
+        self.get_queries(prepare)
+        small = self.get_queries(prepare)
+        self.populate(8)
+        large = self.get_queries(prepare)
+
+        def format_sql(queries):
+            return '\n'.join('  {}'.format(query) for query in queries)
+
+        if len(large) != len(small):
+            self.fail('{}: {} queries with little data but {} with more:\n{}'.format(
+                name, len(small), len(large), format_sql(large)))
+        budget = self.budgets[name]
+        if len(large) > budget:
+            self.fail('{}: {} queries, over the budget of {}:\n{}'.format(name, len(large), budget, format_sql(large)))
+
+    def get_entries_url(self):
+        """The journal's entries url, after its current last entry"""
+        last = models.Entry.objects.filter(journal=self.journal).order_by('-id').values_list('uid', flat=True).first()
+        url = reverse('journal-entries-list', kwargs={'journal_uid': self.journal.uid})
+        return url + '?last={}'.format(last)
+
+    def test_journal_list(self):
+        """Listing journals"""
+        self.assertQueryBudget('journal_list', lambda: lambda: self.client.get(reverse('journal-list')))
+
+    def test_journal_retrieve(self):
+        """Retrieving a journal"""
+        url = lambda: reverse('journal-detail', kwargs={'uid': self.journal.uid})  # noqa: E731
+        self.assertQueryBudget('journal_retrieve', lambda: lambda: self.client.get(url()))
+
+    def test_journal_create(self):
+        """Creating a journal"""
+        def prepare():
+            data = serializers.JournalSerializer(models.Journal(uid=self.get_random_hash(), content=b'test')).data
+            return lambda: self.client.post(reverse('journal-list'), data)
+        self.assertQueryBudget('journal_create', prepare)
+
+    def test_entry_list(self):
+        """Listing entries"""
+        url = lambda: reverse('journal-entries-list', kwargs={'journal_uid': self.journal.uid})  # noqa: E731
+        self.assertQueryBudget('entry_list', lambda: lambda: self.client.get(url()))
+
+    def test_entry_create(self):
+        """Appending an entry"""
+        def prepare():
+            url = self.get_entries_url()
+            data = serializers.EntrySerializer(models.Entry(uid=self.get_random_hash(), content=b'test')).data
+            return lambda: self.client.post(url, data)
+        self.assertQueryBudget('entry_create', prepare)
+
+    def test_entry_bulk_create(self):
+        """Appending many entries at once, the number of queries doesn't depend on how many"""
+        sizes = iter([2, 5, 10, 50])
+
+        def prepare():
+            url = self.get_entries_url()
+            entries = [models.Entry(uid=self.get_random_hash(), content=b'test') for _ in range(next(sizes))]
+            data = serializers.EntrySerializer(entries, many=True).data
+            return lambda: self.client.post(url, data, format='json')
+        self.assertQueryBudget('entry_bulk_create', prepare)
+
+    def test_members_list(self):
+        """Listing a journal's members"""
+        url = lambda: reverse('journal-members-list', kwargs={'journal_uid': self.journal.uid})  # noqa: E731
+        self.assertQueryBudget('members_list', lambda: lambda: self.client.get(url()))
+
+    def test_user_info(self):
+        """Retrieving a user's info"""
+        url = lambda: reverse('userinfo-detail', kwargs={'username': self.users[-1].username})  # noqa: E731
+        self.assertQueryBudget('user_info', lambda: lambda: self.client.get(url()))
+
+
+class ServerTimingTestCase(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.journal = models.Journal.objects.create(owner=self.user1, uid=self.get_random_hash(), content=b'test')
+        for _ in range(3):
+            models.Entry.objects.create(journal=self.journal, uid=self.get_random_hash(), content=b'test')
+        self.url = reverse('journal-entries-list', kwargs={'journal_uid': self.journal.uid})
+        self.client.force_authenticate(user=self.user1)
+
+    def test_disabled(self):
+        """No timings unless enabled"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('Server-Timing', response)
+
+    @override_settings(JOURNAL_SERVER_TIMING=True)
+    def test_timing(self):
+        """The timings are sent in the Server-Timing header and logged"""
+        with self.assertLogs('journal.timing', level='INFO') as logs, \
+                CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 3)
+
+        metrics = [metric.split(';')[0] for metric in response['Server-Timing'].split(', ')]
+        self.assertEqual(metrics, ['db', 'serialize', 'render', 'total'])
+        self.assertIn('desc="{} queries"'.format(len(context)), response['Server-Timing'])
+
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['view'], 'EntryViewSet')
+        self.assertEqual(record['action'], 'list')
+        self.assertEqual(record['status'], status.HTTP_200_OK)
+        self.assertEqual(record['queries'], len(context))
+        self.assertGreater(record['serialize_ms'], 0)
+        self.assertGreater(record['render_ms'], 0)
+        self.assertGreaterEqual(record['total_ms'], record['db_ms'] + record['serialize_ms'])
+
+    @override_settings(JOURNAL_SERVER_TIMING=True)
+    def test_errors(self):
+        """Error responses are timed too"""
+        with self.assertLogs('journal.timing', level='INFO'):
+            response = self.client.get(reverse('journal-entries-list', kwargs={'journal_uid': self.get_random_hash()}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertIn('db;dur=', response['Server-Timing'])
+
+
+@override_settings(JOURNAL_METRICS=True)
+class MetricsTestCase(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.registry.clear()
+        self.journal = models.Journal.objects.create(owner=self.user1, uid=self.get_random_hash(), content=b'test')
+        self.entry = models.Entry.objects.create(journal=self.journal, uid=self.get_random_hash(), content=b'test')
+        self.url = reverse('journal-entries-list', kwargs={'journal_uid': self.journal.uid})
+        self.client.force_authenticate(user=self.user1)
+
+    def get_samples(self):
+        response = self.raw_client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        lines = response.content.decode('utf-8').splitlines()
+        return dict(line.rsplit(' ', 1) for line in lines if not line.startswith('#'))
+
+    def test_requests(self):
+        """Requests are counted and timed per viewset and action"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.client.get(self.url)
+
+        labels = 'viewset="EntryViewSet",action="list"'
+        samples = self.get_samples()
+        self.assertEqual(samples['journal_requests_total{' + labels + ',status="200"}'], '2')
+        self.assertEqual(samples['journal_request_duration_seconds_count{' + labels + '}'], '2')
+        self.assertEqual(samples['journal_request_duration_seconds_bucket{' + labels + ',le="+Inf"}'], '2')
+        self.assertEqual(samples['journal_response_bytes_sum{' + labels + '}'], str(2 * len(response.content)))
+
+    @override_settings(JOURNAL_STREAM_ENTRIES=True)
+    def test_streamed(self):
+        """Streamed responses are measured once sent"""
+        response = self.client.get(self.url)
+        content = b''.join(response.streaming_content)
+        samples = self.get_samples()
+        self.assertEqual(samples['journal_response_bytes_sum{viewset="EntryViewSet",action="list"}'],
+                         str(len(content)))
+
+    def test_append_conflicts(self):
+        """Append conflicts and the time spent claiming the journal are measured"""
+        entry = models.Entry(uid=self.get_random_hash(), content=b'test')
+        response = self.client.post(self.url + '?last={}'.format(self.entry.uid),
+                                    serializers.EntrySerializer(entry).data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        entry = models.Entry(uid=self.get_random_hash(), content=b'test')
+        response = self.client.post(self.url + '?last={}'.format(self.entry.uid),
+                                    serializers.EntrySerializer(entry).data)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+        samples = self.get_samples()
+        self.assertEqual(samples['journal_requests_total{viewset="EntryViewSet",action="create",status="409"}'], '1')
+        self.assertEqual(samples['journal_append_conflicts_total{reason="stale"}'], '1')
+        self.assertEqual(samples['journal_append_lock_wait_seconds_count'], '1')
+
+    @override_settings(JOURNAL_METRICS=False)
+    def test_disabled(self):
+        """Nothing is collected unless enabled"""
+        self.client.get(self.url)
+        self.assertNotIn('journal_requests_total{viewset="EntryViewSet",action="list",status="200"}',
+                         self.get_samples())
+
+    def test_histogram(self):
+        """Histogram buckets are cumulative and include their upper bound"""
+        histogram = metrics.Histogram('test_histogram', 'Test.', ('name', ), buckets=(1, 10))
+        for value in (0.5, 1, 5, 50):
+            histogram.observe(value, name='a"b')
+        self.assertEqual(histogram.render().splitlines()[2:], [
+            'test_histogram_bucket{name="a\\"b",le="1"} 2',
+            'test_histogram_bucket{name="a\\"b",le="10"} 3',
+            'test_histogram_bucket{name="a\\"b",le="+Inf"} 4',
+            'test_histogram_sum{name="a\\"b"} 56.5',
+            'test_histogram_count{name="a\\"b"} 4',
+        ])
+
+    def test_threads(self):
+        """Concurrent updates aren't lost"""
+        counter = metrics.Counter('test_counter', 'Test.')
+
+        def increment():
+            for _ in range(1000):
+                counter.inc()
+
+        threads = [threading.Thread(target=increment) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(counter.get(), 8000)
+
+
+@override_settings(JOURNAL_THROTTLE_RATE=0.01, JOURNAL_THROTTLE_BURST=10)
+class ThrottlingTestCase(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.journal = models.Journal.objects.create(owner=self.user1, uid=self.get_random_hash(), content=b'test')
+        self.entries = [models.Entry.objects.create(journal=self.journal, uid=self.get_random_hash(), content=b'test')
+                        for _ in range(8)]
+        self.url = reverse('journal-entries-list', kwargs={'journal_uid': self.journal.uid})
+        self.client.force_authenticate(user=self.user1)
+        patcher = mock.patch.object(views.EntryViewSet, 'throttle_classes', [throttling.CostThrottle])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_full_downloads(self):
+        """Downloading all of the entries costs one token per entry"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        # 6 more tokens are needed, at 0.01 per second
+        self.assertAlmostEqual(int(response['Retry-After']), 600, delta=1)
+
+        # Other users have their own buckets
+        models.JournalMember.objects.create(journal=self.journal, user=self.user2, key=b'key')
+        self.client.force_authenticate(user=self.user2)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_not_modified(self):
+        """Polls answered with 304 only cost one token"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        for _ in range(2):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # But once there's something new, it's the full download again
+        models.Entry.objects.create(journal=self.journal, uid=self.get_random_hash(), content=b'test')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_incremental(self):
+        """Fetching the entries after the last one only costs those entries"""
+        for _ in range(5):
+            response = self.client.get(self.url + '?last={}'.format(self.entries[-2].uid))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(response.data), 1)
+
+        # Limited to the page size
+        response = self.client.get(self.url + '?limit=2')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(self.url + '?limit=4')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_sync(self):
+        """Syncing costs one token per entry of all of the journals"""
+        url = reverse('journal-sync')
+        with mock.patch.object(views.JournalViewSet, 'throttle_classes', [throttling.CostThrottle]):
+            for _ in range(2):
+                response = self.client.post(url, {self.journal.uid: self.entries[-2].uid}, format='json')
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+            response = self.client.post(url, {self.journal.uid: None}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            response = self.client.post(url, {self.journal.uid: None}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_refill(self):
+        """The bucket is refilled over time, and a full one lets through requests costing more than it holds"""
+        last = [models.Entry.objects.create(journal=self.journal, uid=self.get_random_hash(), content=b'test')
+                for _ in range(10)][-1]
+        url = self.url + '?last={}'.format(last.uid)
+
+        with mock.patch.object(throttling.CostThrottle, 'timer', return_value=1000):
+            response = self.client.get(self.url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertEqual(response['Retry-After'], '900')
+
+        # Taking 18 out of 10 leaves it 8 short, and then another one is needed for the request
+        with mock.patch.object(throttling.CostThrottle, 'timer', return_value=1000 + 800):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        with mock.patch.object(throttling.CostThrottle, 'timer', return_value=1000 + 900):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+@override_settings(DATABASE_ROUTERS=['journal.routers.ReplicaRouter'], JOURNAL_READ_REPLICAS=['replica'])
+class ReplicaRouterTestCase(BaseTestCase):
+    # The replica is a separate (empty) database, so we can tell where reads went
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.journal = models.Journal.objects.create(owner=self.user1, uid=self.get_random_hash(), content=b'test')
+        models.JournalMember.objects.create(journal=self.journal, user=self.user2, key=b'key')
+        self.client.force_authenticate(user=self.user1)
+
+    def get_journal_uids(self):
+        response = self.client.get(reverse('journal-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [journal['uid'] for journal in response.data]
+
+    def test_reads(self):
+        """Safe requests read from the replica, others from the primary"""
+        self.assertEqual(self.get_journal_uids(), [])
+        response = self.client.get(reverse('journal-detail', kwargs={'uid': self.journal.uid}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        # Appending needs to see the journal
+        self.client.force_authenticate(user=self.user2)
+        url = reverse('journal-entries-list', kwargs={'journal_uid': self.journal.uid})
+        entry = models.Entry(uid=self.get_random_hash(), content=b'test')
+        response = self.client.post(url, serializers.EntrySerializer(entry).data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(models.Entry.objects.using('default').filter(journal=self.journal).count(), 1)
+
+    def test_read_your_writes(self):
+        """Users read from the primary for a while after writing"""
+        journal = models.Journal(uid=self.get_random_hash(), content=b'test')
+        response = self.client.post(reverse('journal-list'), serializers.JournalSerializer(journal).data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(set(self.get_journal_uids()), {self.journal.uid, journal.uid})
+
+        # Only the user that wrote
+        self.client.force_authenticate(user=self.user2)
+        self.assertEqual(self.get_journal_uids(), [])
+
+        # Until the window is over
+        cache.clear()
+        self.client.force_authenticate(user=self.user1)
+        self.assertEqual(self.get_journal_uids(), [])
+
+    def test_read_only_actions(self):
+        """Syncing and polling for changes read from the replica and don't stick the user to the primary"""
+        for name in ('journal-sync', 'journal-changes'):
+            response = self.client.post(reverse(name) + '?timeout=0', {self.journal.uid: None}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            # The journal is only in the primary
+            self.assertEqual(response.data, {})
+        self.assertIsNone(cache.get(routers._sticky_key(self.user1.pk)))
+        self.assertEqual(self.get_journal_uids(), [])
+
+    def test_failed_writes(self):
+        """Failed writes don't stick the user to the primary"""
+        response = self.client.post(reverse('journal-list'), {})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.get_journal_uids(), [])
+
+    def test_router(self):
+        """Outside of the viewsets everything goes to the primary"""
+        router = routers.ReplicaRouter()
+        self.assertIsNone(router.db_for_read(models.Journal))
+        self.assertEqual(router.db_for_write(models.Journal), 'default')
+        self.assertIsNone(router.db_for_write(User))
+        self.assertEqual(models.Journal.objects.filter(pk=self.journal.pk).count(), 1)
+
+        # Objects read from a replica are saved to the primary
+        User.objects.using('replica').create(pk=self.user1.pk, username=self.user1.username)
+        models.UserInfo.objects.using('replica').create(owner_id=self.user1.pk, pubkey=b'key', content=b'test')
+        info = models.UserInfo.objects.using('replica').get(owner_id=self.user1.pk)
+        info.content = b'updated'
+        info.save()
+        self.assertEqual(bytes(models.UserInfo.objects.using('default').get(owner_id=self.user1.pk).content),
+                         b'updated')
+
+
 class DebugOnlyTestCase(BaseTestCase):
     def test_only_debug(self):
         """This endpoint should only be allowed in debug mode"""